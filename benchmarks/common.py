@@ -0,0 +1,135 @@
+"""
+Helpers shared by the benchmarks. They run offline: no Discord connection, no real SIFI, trombi or LDAP.
+
+Run them from the root of the repository, e.g. `python -m benchmarks.prefix`.
+"""
+import json
+import os
+import statistics
+import tempfile
+import time
+import types
+import typing
+
+from utils.config import Config
+
+BOT_USER_ID = 673834847470616576
+
+
+def offline_config(**overrides) -> Config:
+    config = Config()
+    config.log_level = "WARNING"
+    config.metrics_enabled = False
+    for name, value in overrides.items():
+        setattr(config, name, value)
+    return config
+
+
+def make_offline_bot(profiles: typing.Optional[dict] = None, config: typing.Optional[Config] = None, **options):
+    """
+    A CustomBot running in a temporary directory, with fake credentials and the given profiles, that believes it is logged in.
+    """
+    from utils.bot import CustomBot
+
+    workdir = tempfile.mkdtemp(prefix="tspbot-bench-")
+    with open(os.path.join(workdir, "credentials.json"), "w") as f:
+        json.dump({"discord_token": "offline"}, f)
+    with open(os.path.join(workdir, "profiles.json"), "w") as f:
+        json.dump(profiles or {}, f)
+    os.chdir(workdir)
+
+    bot = CustomBot(config=config or offline_config(), **options)
+    bot._connection.user = types.SimpleNamespace(id=BOT_USER_ID, name="TSP Bot", discriminator="0000", bot=True, mention=f"<@{BOT_USER_ID}>")
+    return bot
+
+
+def fake_message(bot, content: str, author_id: int = 138751484517941259):
+    """
+    Enough of a discord.Message for CustomBot.on_message and get_context.
+    """
+    guild = types.SimpleNamespace(id=1, name="Benchmark guild")
+    channel = types.SimpleNamespace(id=2, name="general", guild=guild)
+    author = types.SimpleNamespace(id=author_id, name="student", discriminator="0001", bot=False, mention=f"<@{author_id}>")
+    return types.SimpleNamespace(id=3, content=content, author=author, channel=channel, guild=guild, _state=bot._connection)
+
+
+class FakeGuild:
+    """
+    A guild the bot knows nothing about: no cached channels, members or roles.
+    """
+    def __init__(self, guild_id: int = 1, name: str = "Benchmark guild"):
+        self.id = guild_id
+        self.name = name
+
+    def get_channel(self, channel_id: int):
+        return None
+
+    def get_member(self, member_id: int):
+        return None
+
+    def get_role(self, role_id: int):
+        return None
+
+
+class FakeChannel:
+    """
+    Enough of a text channel for discord.Message and the Messageable methods, which go through bot.http.
+    """
+    def __init__(self, bot, channel_id: int = 2, name: str = "general", guild: typing.Optional[FakeGuild] = None):
+        self.id = channel_id
+        self.name = name
+        self.guild = guild or FakeGuild()
+        self._state = bot._connection
+
+    @property
+    def mention(self):
+        return f"<#{self.id}>"
+
+
+def user_payload(user_id: int, name: str = "student", bot: bool = False) -> dict:
+    return {"id": str(user_id), "username": name, "discriminator": "0001", "avatar": None, "bot": bot}
+
+
+def message_payload(message_id: int, channel_id: int, content: str, author: dict) -> dict:
+    """
+    A message as the Discord API returns it.
+    """
+    return {"id": str(message_id), "channel_id": str(channel_id), "content": content, "author": author,
+            "attachments": [], "embeds": [], "mentions": [], "mention_roles": [], "pinned": False, "mention_everyone": False,
+            "tts": False, "type": 0, "timestamp": "2021-01-18T12:00:00+00:00", "edited_timestamp": None}
+
+
+def make_message(bot, channel: FakeChannel, content: str, message_id: int, author_id: int = 138751484517941259):
+    """
+    A real discord.Message, built like the gateway would, that commands can reply to, edit or delete.
+    """
+    return bot._connection.create_message(channel=channel, data=message_payload(message_id, channel.id, content, user_payload(author_id, f"student{author_id % 10000}")))
+
+
+def summarize(durations: typing.List[float]) -> dict:
+    """
+    Count, mean, p50 and p99 of a list of durations, in seconds.
+    """
+    ordered = sorted(durations)
+    return {"count": len(ordered),
+            "mean": statistics.mean(ordered) if ordered else 0.0,
+            "p50": ordered[int(0.50 * (len(ordered) - 1))] if ordered else 0.0,
+            "p99": ordered[int(0.99 * (len(ordered) - 1))] if ordered else 0.0}
+
+
+def time_function(func: typing.Callable[[], typing.Any], iterations: int) -> typing.List[float]:
+    durations = []
+    for _ in range(iterations):
+        start = time.perf_counter()
+        func()
+        durations.append(time.perf_counter() - start)
+    return durations
+
+
+async def time_coroutine(factory: typing.Callable[[], typing.Awaitable], iterations: int) -> typing.List[float]:
+    durations = []
+    for _ in range(iterations):
+        start = time.perf_counter()
+        await factory()
+        durations.append(time.perf_counter() - start)
+    return durations
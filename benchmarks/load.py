@@ -0,0 +1,229 @@
+"""
+Command load harness: synthetic messages go through CustomBot.on_message, get_context and invoke like gateway events would,
+with the cogs talking to the stand-in SIFI and trombi of benchmarks/standin.py, and the Discord API replaced by a stub.
+
+    python -m benchmarks.load [--scenario notes_same_user] [--messages 1000] [--concurrency 50] [--output report.json] ...
+
+The report is a JSON document, printed or written to --output, with for every scenario the commands per second, the latency
+of on_message, and what became of the commands (ok, or the error they failed with, e.g. MaxConcurrencyReached).
+"""
+import argparse
+import asyncio
+import collections
+import datetime
+import itertools
+import json
+import os
+import subprocess
+import sys
+import time
+import typing
+
+from discord.ext import commands
+
+from benchmarks.common import BOT_USER_ID, FakeChannel, make_message, make_offline_bot, message_payload, offline_config, summarize, user_payload
+from benchmarks.standin import StandIn
+
+EXTENSIONS = ['cogs.error_handling',
+              'cogs.notes',
+              'cogs.profile',
+              'cogs.trombi',
+              ]
+
+FIRST_AUTHOR_ID = 300000000000000000
+FIRST_CHANNEL_ID = 400000000000000000
+FIRST_MESSAGE_ID = 800000000000000000
+FIRST_REPLY_ID = 900000000000000000
+
+Scenario = collections.namedtuple("Scenario", ("content", "authors"))
+
+# Scenarios run in this order. authors=None means every member with a profile, in turn.
+SCENARIOS = collections.OrderedDict([
+    ("ignored", Scenario("Quelqu'un a compris l'exercice 3 du TD de proba ?", None)),
+    ("notes_moyenne", Scenario(";n m", None)),  # the first message of each author downloads their bulletin
+    ("notes_resume", Scenario(";n res", None)),
+    ("notes_same_user", Scenario(";n m", 1)),  # notes has max_concurrency(1, user)
+    ("profile_edit", Scenario(";p e affichage_rang on", None)),  # a storage write each
+    ("trombi_search", Scenario(";t s dupont", None)),
+])
+
+
+class StubHTTP:
+    """
+    Replaces the methods of bot.http that reach the Discord API, answering like the API would after latency seconds.
+    """
+    def __init__(self, latency: float):
+        self.latency = latency
+        self.calls = collections.Counter()
+        self._message_ids = itertools.count(FIRST_REPLY_ID)
+        self._author = user_payload(BOT_USER_ID, "TSP Bot", bot=True)
+
+    def install(self, http):
+        for name in ("send_message", "send_files", "edit_message", "delete_message", "send_typing", "add_reaction"):
+            setattr(http, name, getattr(self, name))
+
+    async def _call(self, endpoint: str):
+        self.calls[endpoint] += 1
+        if self.latency:
+            await asyncio.sleep(self.latency)
+
+    async def send_message(self, channel_id, content, **kwargs):
+        await self._call("send_message")
+        return message_payload(next(self._message_ids), channel_id, content or "", self._author)
+
+    async def send_files(self, channel_id, *, files, content=None, **kwargs):
+        await self._call("send_files")
+        return message_payload(next(self._message_ids), channel_id, content or "", self._author)
+
+    async def edit_message(self, channel_id, message_id, **fields):
+        await self._call("edit_message")
+        return message_payload(message_id, channel_id, fields.get("content") or "", self._author)
+
+    async def delete_message(self, channel_id, message_id, **kwargs):
+        await self._call("delete_message")
+
+    async def send_typing(self, channel_id):
+        await self._call("send_typing")
+
+    async def add_reaction(self, channel_id, message_id, emoji):
+        await self._call("add_reaction")
+
+
+class OutcomeRecorder:
+    """
+    What became of the command of each message, from the command_completion and command_error events.
+    """
+    def __init__(self, bot):
+        self.outcomes: typing.Dict[int, str] = {}
+        bot.add_listener(self.on_command_completion)
+        bot.add_listener(self.on_command_error)
+
+    async def on_command_completion(self, ctx):
+        self.outcomes[ctx.message.id] = "ok"
+
+    async def on_command_error(self, ctx, exception):
+        if isinstance(exception, commands.CommandInvokeError):
+            exception = exception.original
+        self.outcomes[ctx.message.id] = type(exception).__name__
+
+
+def current_commit() -> typing.Optional[str]:
+    try:
+        return subprocess.run(["git", "rev-parse", "HEAD"], capture_output=True, text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+async def run_scenario(bot, name: str, scenario: Scenario, authors: typing.List[int], channels: typing.Dict[int, FakeChannel], message_ids: typing.Iterator[int],
+                       recorder: OutcomeRecorder, stub: StubHTTP, standin: StandIn, args) -> dict:
+    if scenario.authors is not None:
+        authors = authors[:scenario.authors]
+
+    messages = [make_message(bot, channels[author_id], scenario.content, next(message_ids), author_id)
+                for author_id, _ in zip(itertools.cycle(authors), range(args.messages))]
+
+    semaphore = asyncio.Semaphore(args.concurrency)
+    durations = []
+    calls_before = collections.Counter(stub.calls)
+    requests_before = standin.requests
+
+    async def feed(message):
+        async with semaphore:
+            start = time.perf_counter()
+            await bot.on_message(message)
+            durations.append(time.perf_counter() - start)
+
+    start = time.perf_counter()
+    await asyncio.gather(*[feed(message) for message in messages])
+    elapsed = time.perf_counter() - start
+
+    # Let the events dispatched by the last commands, and the error messages they trigger, run
+    await asyncio.sleep(0.1)
+
+    outcomes = collections.Counter(recorder.outcomes.pop(message.id, "ignored") for message in messages)
+    result = {"name": name,
+              "content": scenario.content,
+              "authors": len(authors),
+              "messages": len(messages),
+              "concurrency": args.concurrency,
+              "elapsed": elapsed,
+              "throughput": len(messages) / elapsed if elapsed else 0.0,
+              "latency": summarize(durations),
+              "outcomes": dict(outcomes),
+              "discord_calls": dict(stub.calls - calls_before),
+              "backend_requests": standin.requests - requests_before}
+
+    stats = result["latency"]
+    print(f"{name:<16} {result['throughput']:9.1f} cmd/s   p50 {stats['p50'] * 1e3:8.2f}ms   p99 {stats['p99'] * 1e3:8.2f}ms   {result['outcomes']}", file=sys.stderr)
+    return result
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Load test the bot commands without connecting to Discord.")
+    parser.add_argument("--scenario", action="append", choices=list(SCENARIOS), help="scenario to run, can be repeated (default: all of them)")
+    parser.add_argument("--messages", type=int, default=1000, help="messages sent per scenario")
+    parser.add_argument("--concurrency", type=int, default=50, help="messages being processed at once")
+    parser.add_argument("--accounts", type=int, default=200, help="members with a profile, sending the messages")
+    parser.add_argument("--storage", choices=("json", "sqlite"), default="json", help="profiles storage backend")
+    parser.add_argument("--discord-latency", type=float, default=0.0, help="seconds the stubbed Discord API takes to reply")
+    parser.add_argument("--latency", type=float, default=0.05, help="seconds the stand-in SIFI and trombi take to reply")
+    parser.add_argument("--jitter", type=float, default=0.02, help="seconds of random variation of the stand-in latency")
+    parser.add_argument("--error-rate", type=float, default=0.0, help="fraction of stand-in replies that are an error page")
+    parser.add_argument("--output", help="write the JSON report to this file instead of printing it")
+    args = parser.parse_args()
+
+    # The bot runs in a temporary directory
+    commit = current_commit()
+    if args.output:
+        args.output = os.path.abspath(args.output)
+
+    authors = [FIRST_AUTHOR_ID + i for i in range(args.accounts)]
+    profiles = {str(author_id): {"tsp_user": f"student{i}", "tsp_password": "hunter2"} for i, author_id in enumerate(authors)}
+
+    bot = make_offline_bot(profiles, offline_config(storage_backend=args.storage, sifi_backoff=0.01, output_per=0), case_insensitive=True)
+    stub = StubHTTP(args.discord_latency)
+    stub.install(bot.http)
+    recorder = OutcomeRecorder(bot)
+    standin = StandIn(latency=args.latency, jitter=args.jitter, error_rate=args.error_rate)
+
+    for extension in EXTENSIONS:
+        bot.load_extension(extension)
+
+    async def run():
+        await standin.start()
+        bot.config.sifi_url = standin.sifi_url
+        bot.config.trombi_search_url = standin.trombi_search_url
+        bot.session = bot.make_session()
+
+        # Each account in its own channel, as with DMs: the replies of one channel are paced, which isn't what is measured here
+        channels = {author_id: FakeChannel(bot, channel_id=FIRST_CHANNEL_ID + i) for i, author_id in enumerate(authors)}
+        message_ids = itertools.count(FIRST_MESSAGE_ID)
+        results = []
+        try:
+            for name in args.scenario or SCENARIOS:
+                results.append(await run_scenario(bot, name, SCENARIOS[name], authors, channels, message_ids, recorder, stub, standin, args))
+        finally:
+            for extension in EXTENSIONS:
+                bot.unload_extension(extension)
+            await bot.close_session()
+            await bot.db.close()
+            await standin.stop()
+        return results
+
+    results = bot.loop.run_until_complete(run())
+
+    report = {"generated_at": datetime.datetime.utcnow().isoformat(),
+              "commit": commit,
+              "python": sys.version.split()[0],
+              "settings": vars(args),
+              "scenarios": results}
+
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(report, f, indent=2)
+    else:
+        print(json.dumps(report, indent=2))
+
+
+if __name__ == "__main__":
+    main()
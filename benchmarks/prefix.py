@@ -0,0 +1,34 @@
+"""
+Cost of an ignored (non-command) message in CustomBot.on_message, with and without the fast prefix check.
+
+    python -m benchmarks.prefix [iterations]
+"""
+import sys
+
+from benchmarks.common import fake_message, make_offline_bot, summarize, time_coroutine
+from utils import context
+
+
+def main(iterations: int = 100000):
+    bot = make_offline_bot()
+    message = fake_message(bot, "Quelqu'un a compris l'exercice 3 du TD de proba ?")
+
+    async def build_context():
+        # What on_message did for every message before the fast path
+        ctx = await bot.get_context(message, cls=context.CustomContext)
+        if ctx.prefix is not None:
+            await bot.invoke(ctx)
+
+    async def run():
+        return {"context": summarize(await time_coroutine(build_context, iterations)),
+                "fast path": summarize(await time_coroutine(lambda: bot.on_message(message), iterations))}
+
+    results = bot.loop.run_until_complete(run())
+
+    print(f"Ignored message, {iterations} iterations:")
+    for name, stats in results.items():
+        print(f"  {name:<10} mean {stats['mean'] * 1e6:8.2f}µs   p50 {stats['p50'] * 1e6:8.2f}µs   p99 {stats['p99'] * 1e6:8.2f}µs")
+
+
+if __name__ == "__main__":
+    main(*[int(arg) for arg in sys.argv[1:2]])
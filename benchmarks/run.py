@@ -0,0 +1,192 @@
+"""
+Benchmarks of the notes and trombi cogs, against the local stand-in server of benchmarks/standin.py.
+
+    python -m benchmarks.run [--accounts 200] [--concurrency 20] [--latency 0.05] [--error-rate 0.02] ...
+
+Reports the throughput and p50/p99 latency of:
+- parsing a bulletin,
+- Notes.get_bulletin with many members asking at once,
+- rendering the notes resume messages,
+- formatting (and fetching) trombi search results,
+- a full pass of the new notes watcher over N watched accounts.
+"""
+import argparse
+import asyncio
+import collections
+import copy
+import time
+import types
+import typing
+
+from benchmarks.common import make_offline_bot, offline_config, summarize, time_function
+from benchmarks.standin import StandIn, load_fixture
+from cogs.notes import Bulletin, Notes, render_resume
+from cogs.trombi import Trombi, format_search_results
+from utils.storage import Profile
+
+FakeMember = collections.namedtuple("FakeMember", ("id", "name"))
+
+FIRST_MEMBER_ID = 300000000000000000
+
+
+class FakeRole:
+    mention = "@everyone"
+
+    def is_default(self):
+        return True
+
+
+class FakeAlertChannel:
+    """
+    Stands for the new notes alert channel, remembering what was sent there.
+    """
+    def __init__(self):
+        self.guild = types.SimpleNamespace(get_role=lambda role_id: None, default_role=FakeRole())
+        self.sent: typing.List[str] = []
+
+    async def send(self, content: str):
+        self.sent.append(content)
+
+
+def report(name: str, durations: typing.List[float], elapsed: typing.Optional[float] = None):
+    """
+    Print one line of results. Throughput is computed on the elapsed wall time when operations overlap.
+    """
+    stats = summarize(durations)
+    elapsed = elapsed if elapsed is not None else sum(durations)
+    throughput = stats["count"] / elapsed if elapsed else 0.0
+    print(f"  {name:<26} {throughput:10.1f}/s   p50 {stats['p50'] * 1e3:9.3f}ms   p99 {stats['p99'] * 1e3:9.3f}ms   ({stats['count']} ops)")
+
+
+async def timed(coroutine: typing.Awaitable, durations: typing.List[float], errors: collections.Counter):
+    start = time.perf_counter()
+    try:
+        await coroutine
+    except Exception as e:
+        errors[type(e).__name__] += 1
+    else:
+        durations.append(time.perf_counter() - start)
+
+
+async def run_concurrently(factories: typing.List[typing.Callable[[], typing.Awaitable]], concurrency: int) -> typing.Tuple[typing.List[float], float, collections.Counter]:
+    """
+    Run the coroutines, at most concurrency of them at once. Returns their durations, the elapsed time and the errors.
+    """
+    semaphore = asyncio.Semaphore(concurrency)
+    durations = []
+    errors = collections.Counter()
+
+    async def limited(factory):
+        async with semaphore:
+            await timed(factory(), durations, errors)
+
+    start = time.perf_counter()
+    await asyncio.gather(*[limited(factory) for factory in factories])
+    return durations, time.perf_counter() - start, errors
+
+
+def without_last_grade(payload: dict) -> dict:
+    """
+    The same SIFI reply, with its last grade not published yet.
+    """
+    payload = copy.deepcopy(payload)
+    details = payload["list1"]["list1_Details_Group_Collection"]["list1_Details_Group"]["table2"]["Detail_Collection"]["Detail"]
+    for detail in reversed(details):
+        attributes = detail["@attributes"]
+        if attributes["textbox22"] and attributes.get("textbox52"):
+            del attributes["textbox52"]
+            break
+    return payload
+
+
+def bench_parsing(iterations: int):
+    payload = load_fixture("sifi_bulletin.json")
+    profile = Profile({"tsp_user": "dupont_c", "tsp_password": "hunter2"})
+    bulletin = Bulletin(profile, payload)
+
+    report("Bulletin parsing", time_function(lambda: Bulletin(profile, payload), iterations))
+    report("resume rendering", time_function(lambda: render_resume(bulletin, show_rang=True), iterations))
+
+    people = load_fixture("trombi_search.json")
+    report("trombi formatting", time_function(lambda: format_search_results(people), iterations))
+
+
+async def bench_cogs(bot, standin: StandIn, members: typing.List[FakeMember], args):
+    notes = Notes(bot)
+    trombi = Trombi(bot)
+
+    try:
+        # Every call downloads, as the cache would otherwise answer most of them
+        durations, elapsed, errors = await run_concurrently([lambda member=member: notes.get_bulletin(member, force_refresh=True) for member in members],
+                                                            args.concurrency)
+        report(f"get_bulletin (x{args.concurrency})", durations, elapsed)
+        if errors:
+            print(f"    failed: {dict(errors)}")
+
+        durations, elapsed, errors = await run_concurrently([lambda: trombi.search_people("dupont") for _ in members], args.concurrency)
+        report(f"trombi search (x{args.concurrency})", durations, elapsed)
+        if errors:
+            print(f"    failed: {dict(errors)}")
+
+        # Half the watched accounts get a new grade during the pass
+        alert_channel = FakeAlertChannel()
+        notes.alert_notes_channel = alert_channel
+        older = Bulletin(Profile({"tsp_user": "older", "tsp_password": "hunter2"}), without_last_grade(standin.sifi_payload))
+        newer = Bulletin(Profile({"tsp_user": "newer", "tsp_password": "hunter2"}), standin.sifi_payload)
+        for index, member in enumerate(members):
+            notes.refresh_users[member] = older if index % 2 else newer
+            notes.poller.add(member)
+            notes.poller.states[member].next_poll = 0
+
+        # What notify_notes_loop does, waiting for the polls to finish
+        due = notes.poller.due()
+        durations, elapsed, errors = await run_concurrently([lambda member=member: notes.poll_user(member) for member in due], len(due))
+        report(f"notify pass ({len(due)} accounts)", durations, elapsed)
+        failed = sum(1 for state in notes.poller.states.values() if state.failures)
+        print(f"    whole pass {elapsed:.3f}s, {len(alert_channel.sent)} alerts sent, {failed} polls failed")
+
+    finally:
+        notes.cog_unload()
+
+    print(f"  stand-in: {standin.requests} requests, {standin.errors} errors")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Offline benchmarks of the notes and trombi cogs.")
+    parser.add_argument("--iterations", type=int, default=10000, help="iterations of the CPU bound benchmarks")
+    parser.add_argument("--accounts", type=int, default=200, help="members with a profile, and watched accounts")
+    parser.add_argument("--concurrency", type=int, default=20, help="requests made at once")
+    parser.add_argument("--latency", type=float, default=0.05, help="seconds the stand-in waits before replying")
+    parser.add_argument("--jitter", type=float, default=0.02, help="seconds of random variation of the latency")
+    parser.add_argument("--error-rate", type=float, default=0.0, help="fraction of replies that are a 503 error page")
+    args = parser.parse_args()
+
+    print(f"CPU bound, {args.iterations} iterations:")
+    bench_parsing(args.iterations)
+
+    members = [FakeMember(FIRST_MEMBER_ID + i, f"student{i}") for i in range(args.accounts)]
+    profiles = {str(member.id): {"tsp_user": member.name, "tsp_password": "hunter2"} for member in members}
+
+    # Retries shouldn't make the benchmark wait for seconds
+    bot = make_offline_bot(profiles, offline_config(sifi_backoff=0.01))
+    standin = StandIn(latency=args.latency, jitter=args.jitter, error_rate=args.error_rate)
+
+    async def run():
+        await standin.start()
+        bot.config.sifi_url = standin.sifi_url
+        bot.config.trombi_search_url = standin.trombi_search_url
+        bot.session = bot.make_session()
+
+        print(f"Against the stand-in, {args.latency * 1e3:.0f}±{args.jitter * 1e3:.0f}ms latency, {args.error_rate:.0%} errors:")
+        try:
+            await bench_cogs(bot, standin, members, args)
+        finally:
+            await bot.close_session()
+            await bot.db.close()
+            await standin.stop()
+
+    bot.loop.run_until_complete(run())
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,126 @@
+"""
+Local stand-in for SIFI and the trombi API, serving the recorded replies of benchmarks/fixtures.
+
+    python -m benchmarks.standin [port]
+
+Point Config.sifi_url and Config.trombi_search_url at it (see StandIn.sifi_url and StandIn.trombi_search_url).
+"""
+import asyncio
+import json
+import os
+import random
+import sys
+import typing
+
+from aiohttp import web
+
+FIXTURES_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), "fixtures")
+
+# What SIFI answers when it's overloaded
+ERROR_PAGE = "<html><head><title>503 Service Unavailable</title></head><body><h1>Service Unavailable</h1></body></html>"
+
+
+def load_fixture(name: str) -> dict:
+    with open(os.path.join(FIXTURES_PATH, name), "r") as f:
+        return json.load(f)
+
+
+class StandIn:
+    """
+    aiohttp server replying to POST /sifiQuery.php and GET /api/v1/people/search with the fixtures.
+
+    Every reply is delayed by latency ± jitter seconds, and error_rate of them are a 503 error page instead.
+    The SIFI reply can be customised per username with sifi_payloads, to simulate new grades.
+    """
+    def __init__(self, host: str = "127.0.0.1", port: int = 0, latency: float = 0.05, jitter: float = 0.02, error_rate: float = 0.0):
+        self.host = host
+        self.port = port
+        self.latency = latency
+        self.jitter = jitter
+        self.error_rate = error_rate
+
+        self.sifi_payload = load_fixture("sifi_bulletin.json")
+        self.sifi_payloads: typing.Dict[str, dict] = {}
+        self.trombi_payload = load_fixture("trombi_search.json")
+
+        self.requests = 0
+        self.errors = 0
+        self._runner: typing.Optional[web.AppRunner] = None
+
+    @property
+    def base_url(self) -> str:
+        return f"http://{self.host}:{self.port}"
+
+    @property
+    def sifi_url(self) -> str:
+        return f"{self.base_url}/sifiQuery.php"
+
+    @property
+    def trombi_search_url(self) -> str:
+        return f"{self.base_url}/api/v1/people/search"
+
+    async def _delay(self) -> bool:
+        """
+        Wait like the real server would, and tell whether this request should fail.
+        """
+        self.requests += 1
+        await asyncio.sleep(max(0.0, self.latency + random.uniform(-self.jitter, self.jitter)))
+        if random.random() < self.error_rate:
+            self.errors += 1
+            return True
+        return False
+
+    def _error(self) -> web.Response:
+        return web.Response(status=503, text=ERROR_PAGE, content_type="text/html")
+
+    async def sifi(self, request: web.Request) -> web.Response:
+        data = await request.post()
+        if await self._delay():
+            return self._error()
+        payload = self.sifi_payloads.get(data.get("username"), self.sifi_payload)
+        # SIFI doesn't set a JSON content type, hence the content_type=None in the cog
+        return web.Response(text=json.dumps(payload), content_type="text/html")
+
+    async def trombi_search(self, request: web.Request) -> web.Response:
+        if await self._delay():
+            return self._error()
+        # Every result of the fixture fits on the first page
+        if request.query.get("page", "1") != "1":
+            return web.json_response(dict(self.trombi_payload, people=[], page=int(request.query["page"])))
+        return web.json_response(self.trombi_payload)
+
+    async def start(self):
+        app = web.Application()
+        app.router.add_post("/sifiQuery.php", self.sifi)
+        app.router.add_get("/api/v1/people/search", self.trombi_search)
+
+        self._runner = web.AppRunner(app, access_log=None)
+        await self._runner.setup()
+        site = web.TCPSite(self._runner, self.host, self.port)
+        await site.start()
+
+        if not self.port:
+            # Port 0 lets the OS pick a free one
+            self.port = self._runner.addresses[0][1]
+
+    async def stop(self):
+        if self._runner is not None:
+            await self._runner.cleanup()
+            self._runner = None
+
+
+def main(port: int = 8080):
+    loop = asyncio.get_event_loop()
+    standin = StandIn(port=port)
+    loop.run_until_complete(standin.start())
+    print(f"SIFI on {standin.sifi_url}, trombi on {standin.trombi_search_url}")
+    try:
+        loop.run_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        loop.run_until_complete(standin.stop())
+
+
+if __name__ == "__main__":
+    main(*[int(arg) for arg in sys.argv[1:2]])
@@ -0,0 +1,66 @@
+import typing
+
+from discord.ext import commands
+from utils.context import CustomContext
+
+if typing.TYPE_CHECKING:
+    from utils.bot import CustomBot
+
+
+class Monitoring(commands.Cog):
+    """
+    Santé du bot (réservé au propriétaire)
+    """
+    def __init__(self, bot: 'CustomBot'):
+        self.bot = bot
+
+    async def cog_check(self, ctx: CustomContext):
+        if not await self.bot.is_owner(ctx.author):
+            raise commands.NotOwner()
+        return True
+
+    @commands.group()
+    async def loop(self, ctx: CustomContext):
+        """
+        Rapport sur la latence de la boucle d'évènements, et les callbacks qui la bloquent.
+        """
+        if not ctx.invoked_subcommand:
+            await ctx.send(f"```\n{self.bot.loop_monitor.report()}\n```")
+
+    @loop.command(name="on")
+    async def loop_on(self, ctx: CustomContext):
+        """
+        Active la surveillance de la boucle.
+        """
+        self.bot.loop_monitor.start()
+        await ctx.send_to("👌 Surveillance de la boucle activée.")
+
+    @loop.command(name="off")
+    async def loop_off(self, ctx: CustomContext):
+        """
+        Désactive la surveillance de la boucle.
+        """
+        self.bot.loop_monitor.stop()
+        await ctx.send_to("👌 Surveillance de la boucle désactivée.")
+
+    @loop.command(name="clear")
+    async def loop_clear(self, ctx: CustomContext):
+        """
+        Oublie les callbacks lents enregistrés.
+        """
+        self.bot.loop_monitor.slow_callbacks.clear()
+        self.bot.loop_monitor.lag_samples.clear()
+        await ctx.send_to("👌 Rapport vidé.")
+
+    @loop.command(name="debug")
+    async def loop_debug(self, ctx: CustomContext, enabled: bool):
+        """
+        Active le mode debug d'asyncio, temporairement : il ralentit toutes les coroutines.
+        """
+        self.bot.loop.set_debug(enabled)
+        await ctx.send_to(f"👌 Mode debug d'asyncio {'activé' if enabled else 'désactivé'}.")
+
+
+def setup(bot: 'CustomBot'):
+    cog = Monitoring(bot)
+    bot.add_cog(cog)
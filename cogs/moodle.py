@@ -1,42 +1,18 @@
+import asyncio
+import os
 import typing
 
 import discord
 from discord.ext import commands
 from discord.ext.commands.cooldowns import BucketType
+from utils.bbb import BBBError, ExportJob, ExportQueue, SlidesExporter, parse_recording_url
 from utils.context import CustomContext
 
 if typing.TYPE_CHECKING:
     from utils.bot import CustomBot
 
-import asyncio
-from asyncio.subprocess import PIPE, STDOUT
-
-
-class Result:
-
-    def __init__(self, status, stdout, stderr):
-        self.status = status
-        self._stdout = stdout or ""
-        self._stderr = stderr or ""
-        if stdout is not None:
-            self.stdout = stdout.decode("utf-8")
-        else:
-            self.stdout = None
-        if stderr is not None:
-            self.stderr = stderr.decode("utf-8")
-        else:
-            self.stderr = None
-
-    def __repr__(self):
-        return f"<Result status={self.status} stdout={len(self._stdout)} stderr={len(self._stderr)}>"
-
-
-async def run(shell_command, *args):
-    p = await asyncio.create_subprocess_exec(shell_command, *args,
-                                              stdin=PIPE, stdout=PIPE, stderr=STDOUT)
-    stdout, stderr = await p.communicate()
-    code = p.returncode
-    return Result(code, stdout, stderr)
+# Without a guild, or boosts, that's what Discord accepts
+DEFAULT_FILESIZE_LIMIT = 8 * 1024 * 1024
 
 
 class Moodle(commands.Cog):
@@ -45,22 +21,79 @@ class Moodle(commands.Cog):
     """
     def __init__(self, bot: 'CustomBot'):
         self.bot = bot
+        self.slides = SlidesExporter(bot)
+        self.exports = ExportQueue(bot, self.slides)
+
+    def cog_unload(self):
+        self.exports.close()
+        self.slides.close()
+
+    def job_status(self, job: ExportJob) -> str:
+        position = self.exports.position(job)
+        if position:
+            others = f" ({job.requesters} personnes attendent ces slides)" if job.requesters > 1 else ""
+            return f"En attente, position {position} dans la file{others}..."
+        return str(job.progress)
+
+    async def report_progress(self, message: discord.Message, job: ExportJob):
+        last_content = message.content
+        while True:
+            await asyncio.sleep(self.bot.config.bbb_progress_interval)
+            content = self.job_status(job)
+            if content != last_content:
+                try:
+                    await message.edit(content=content)
+                except discord.HTTPException as e:
+                    self.bot.logger.warning(f"[bbb] Couldn't update the progress message: {e}")
+                    continue
+                last_content = content
+
+    async def send_pdf(self, ctx: CustomContext, path: str):
+        filesize_limit = ctx.guild.filesize_limit if ctx.guild else DEFAULT_FILESIZE_LIMIT
+        if os.path.getsize(path) > filesize_limit:
+            await ctx.send_to("❌ Le PDF de ces slides est trop gros pour être envoyé sur Discord.")
+            return
+        await ctx.send(file=discord.File(path, filename="slides.pdf"))
 
     @commands.command(aliases=["bbbs"])
     async def bbb_slides(self, ctx: CustomContext, url:str):
         """
         Télécharge les slides d'une conference BBB
         """
-        async with ctx.typing():
-            r = await run("utils/download_slides_from_bigblue_button.sh", url)
         try:
-            f = discord.File(str(r.stdout).splitlines()[-1])
-            await ctx.send(file=f)
-        except:
-            ctx.logger.error("Failed to send a file, here is the output of the conversion script:")
-            ctx.logger.error(r.stdout)
-            ctx.logger.error(r.stderr)
+            _, meeting_id = parse_recording_url(url)
+        except BBBError as e:
+            await ctx.send_to(f"❌ {e}")
+            return
+
+        # Someone already asked for these slides
+        path = await self.exports.cache.get(meeting_id)
+        if path is not None:
+            await self.send_pdf(ctx, path)
+            return
+
+        job = self.exports.submit(url, meeting_id)
+        progress_message = await ctx.send(self.job_status(job))
+        reporter = self.bot.loop.create_task(self.report_progress(progress_message, job))
+        try:
+            # Shielded, so that a cancelled command doesn't cancel the export for everyone else.
+            path, count = await asyncio.shield(job.future)
+        except BBBError as e:
+            await progress_message.edit(content=f"❌ {e}")
+            return
+        except asyncio.CancelledError:
             raise
+        except Exception as e:
+            # Otherwise the progress message would keep showing the last step
+            await progress_message.edit(content="❌ L'export des slides a échoué, réessayez plus tard.")
+            self.bot.logger.warning(f"[bbb] Export of {meeting_id} failed: {e!r}")
+            raise
+        finally:
+            reporter.cancel()
+            job.requesters -= 1
+
+        await progress_message.edit(content=f"👌 {count} slides exportées.")
+        await self.send_pdf(ctx, path)
 
 
 def setup(bot: 'CustomBot'):
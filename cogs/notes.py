@@ -1,7 +1,8 @@
 import asyncio
-import json
+import collections
 import random
 import re
+import sys
 import time
 import typing
 
@@ -9,6 +10,10 @@ import aiohttp
 import discord
 from discord.ext import commands, tasks
 from discord.ext.commands.cooldowns import BucketType
+from utils import fetch_scheduler, metrics
+from utils.bulletin_cache import BulletinCache
+from utils.fetch_scheduler import FetchRequest, FetchScheduler
+from utils.polling import AdaptivePoller
 from utils.storage import Profile
 
 from utils.context import CustomContext
@@ -17,73 +22,170 @@ if typing.TYPE_CHECKING:
     from utils.bot import CustomBot
 
 
+RANG_REGEX = re.compile(r"(?P<rang>\d{1,3}) \/ (?P<nb_etudiants>\d{1,3})")
+
+
+class Note:
+    """
+    One line of the bulletin: either an UE (category) or a course.
+    """
+    __slots__ = ("is_category", "code", "nom", "note", "ECTS")
+
+    def __init__(self, is_category: bool, code: str, nom: str, note: typing.Union[None, bool, float], ECTS: typing.Optional[int]):
+        self.is_category = is_category
+        self.code = code
+        self.nom = nom
+        self.note = note
+        self.ECTS = ECTS
+
+    def __repr__(self):
+        return f"<Note code={self.code} note={self.note}>"
+
+
 class Bulletin:
-    def __init__(self, profile: Profile, retour_sifi):
+    """
+    Bulletin parsed once from the SIFI reply. The reply itself isn't kept around.
+    """
+    __slots__ = ("profile", "ecole", "annee_scolaire", "nom", "niveau", "rang", "moyenne", "notes_count", "notes_by_code", "_notes")
+
+    def __init__(self, profile: Profile, retour_sifi: dict):
         self.profile = profile
-        self.retour_sifi = retour_sifi
 
-    @property
-    def ecole(self) -> str:
-        return self.retour_sifi["list1"]["list1_Details_Group_Collection"]["list1_Details_Group"]["@attributes"]["X_Ecole"]
+        group = retour_sifi["list1"]["list1_Details_Group_Collection"]["list1_Details_Group"]
+        attributes = group["@attributes"]
 
-    @property
-    def annee_scolaire(self) -> str:
-        return self.retour_sifi["list1"]["list1_Details_Group_Collection"]["list1_Details_Group"]["@attributes"]["X_AnnSco"]
+        # The same strings are found in every bulletin of a school
+        self.ecole: str = sys.intern(attributes["X_Ecole"])
+        self.annee_scolaire: str = sys.intern(attributes["X_AnnSco"])
+        self.nom: str = attributes["textbox10"]
+        self.niveau: str = sys.intern(attributes["niveau_LMD"])
 
-    @property
-    def nom(self) -> str:
-        return self.retour_sifi["list1"]["list1_Details_Group_Collection"]["list1_Details_Group"]["@attributes"]["textbox10"]
+        #    Rang :               8 / 209
+        match = RANG_REGEX.search(attributes["textbox19"])
+        self.rang: typing.Optional[typing.Tuple[int, int]] = (int(match.group('rang')), int(match.group("nb_etudiants"))) if match else None
 
-    @property
-    def niveau(self) -> str:
-        return self.retour_sifi["list1"]["list1_Details_Group_Collection"]["list1_Details_Group"]["@attributes"]["niveau_LMD"]
+        moyenne_text = group["table2"]["@attributes"]["textbox33"]
+        self.moyenne: typing.Optional[float] = float(moyenne_text) if moyenne_text else None
 
-    @property
-    def rang(self) -> typing.Tuple[int, int]:
-        rang_text: str = self.retour_sifi["list1"]["list1_Details_Group_Collection"]["list1_Details_Group"]["@attributes"]["textbox19"]
-        #    Rang :               8 / 209
-        regex = r"(?P<rang>\d{1,3}) \/ (?P<nb_etudiants>\d{1,3})"
-        match = re.search(regex, rang_text)
+        notes = []
+        for matiere_sifi in group["table2"]["Detail_Collection"]["Detail"]:
+            vraie_matiere = matiere_sifi["@attributes"]
+            note_maybe = vraie_matiere.get("textbox52", None)
+            if note_maybe == "Validé":
+                note = True
+            elif note_maybe:
+                note = float(note_maybe)
+            else:
+                note = None
+            notes.append(Note(is_category=vraie_matiere["textbox22"] == "",
+                              code=sys.intern(vraie_matiere["textbox38"].strip()),
+                              nom=sys.intern(vraie_matiere["textbox40"].strip()),
+                              note=note,
+                              ECTS=int(vraie_matiere["textbox22"]) if vraie_matiere["textbox22"] else None))
+
+        self._notes: typing.Tuple[Note, ...] = tuple(notes)
+        self.notes_count: int = sum(1 for note in notes if not note.is_category and note.note is not None)
+
+        self.notes_by_code: typing.Dict[str, Note] = {}
+        for note in notes:
+            self.notes_by_code.setdefault(note.code, note)
+
+    def notes(self, get_categories=True) -> typing.List[Note]:
+        if get_categories:
+            return list(self._notes)
+        else:
+            return [note for note in self._notes if not note.is_category]
 
-        return int(match.group('rang')), int(match.group("nb_etudiants"))
 
-    @property
-    def moyenne(self) -> float:
-        return float(self.retour_sifi["list1"]["list1_Details_Group_Collection"]["list1_Details_Group"]["table2"]["@attributes"]["textbox33"])
+class BulletinDiff:
+    """
+    Grades that appeared, disappeared or changed value between two bulletins. Only courses are compared, not the UE averages.
+    """
+    __slots__ = ("added", "removed", "changed")
 
-    def notes(self, get_categories=True):
-        notes_sifi = self.retour_sifi["list1"]["list1_Details_Group_Collection"]["list1_Details_Group"]["table2"]["Detail_Collection"]["Detail"]
+    def __init__(self):
+        self.added: typing.List[Note] = []
+        self.removed: typing.List[Note] = []
+        self.changed: typing.List[typing.Tuple[Note, Note]] = []
 
-        notes_parsed = []
+    def __bool__(self):
+        return bool(self.added or self.removed or self.changed)
 
-        for matiere_sifi in notes_sifi:
-            vraie_matiere = matiere_sifi["@attributes"]
-            category = vraie_matiere["textbox22"] == ""
-            if not category or get_categories:
-                note_maybe = vraie_matiere.get("textbox52", None)
-                if note_maybe == "Validé":
-                    note = True
-                elif note_maybe:
-                    note = float(note_maybe)
+    def __repr__(self):
+        return f"<BulletinDiff added={self.added} removed={self.removed} changed={self.changed}>"
+
+
+def diff_bulletins(old: Bulletin, new: Bulletin) -> BulletinDiff:
+    """
+    Compare the grades of two bulletins, matching courses on their code.
+    """
+    diff = BulletinDiff()
+    old_index = old.notes_by_code
+    new_index = new.notes_by_code
+
+    for note in new.notes(get_categories=False):
+        old_note = old_index.get(note.code)
+        old_value = old_note.note if old_note and not old_note.is_category else None
+
+        # 0 is a grade, only None means there's none
+        if note.note is not None and old_value is None:
+            diff.added.append(note)
+        elif note.note is not None and note.note != old_value:
+            diff.changed.append((old_note, note))
+        elif old_value is not None and note.note is None:
+            diff.removed.append(old_note)
+
+    for old_note in old.notes(get_categories=False):
+        if old_note.note is not None and old_note.code not in new_index:
+            diff.removed.append(old_note)
+
+    return diff
+
+
+STALE_WARNING = "\n⚠️ Ces notes ne sont peut-être plus à jour, elles sont en cours de rafraîchissement."
+
+# What a failed request to SIFI looks like. Parsing errors usually mean it replied with an error page.
+SIFI_ERRORS = (asyncio.TimeoutError, aiohttp.ClientError, ValueError, TypeError, KeyError)
+# The ones worth trying again: a parsing error would happen again
+SIFI_TRANSIENT_ERRORS = (asyncio.TimeoutError, aiohttp.ClientError)
+
+
+def render_resume(bulletin: Bulletin, show_rang: bool, stale: bool = False) -> str:
+    """
+    The text of the notes resume command: average, rank, and every grade grouped by UE.
+    """
+    if show_rang and bulletin.rang is not None:
+        rang, nb_etudiants = bulletin.rang
+        rang_msg = f", vous etes classé **{rang}e sur {nb_etudiants}** etudiants"
+    else:
+        rang_msg = ""
+
+    message_list = [
+        f"{bulletin.ecole} — Année scolaire {bulletin.annee_scolaire} — **{bulletin.nom}**",
+        f"Vous avez une moyenne de **{bulletin.moyenne}**{rang_msg}.",
+        "```diff"
+    ]
+
+    if stale:
+        message_list.insert(2, STALE_WARNING.strip())
+
+    for note in bulletin.notes():
+        if note.note is not None:
+            if note.is_category:
+                message_list.append(f"\n{note.nom} — Moyenne générale {note.note} pts")
+            else:
+                if note.note is True:
+                    message_list.append(f"+ {note.code} ({note.nom}) {note.ECTS} ECTS")
                 else:
-                    note = None
-                notes_parsed.append({
-                    "is_category": category,
-                    "code": vraie_matiere["textbox38"].strip(),
-                    "nom": vraie_matiere["textbox40"].strip(),
-                    "note": note,
-                    "ECTS": int(vraie_matiere["textbox22"]) if vraie_matiere["textbox22"] else None,
-                })
-
-        return notes_parsed
-
-    @property
-    def notes_count(self):
-        nb = 0
-        for note in self.notes(get_categories=False):
-            if note["note"]:
-                nb += 1
-        return nb
+                    if note.note < 10:
+                        symbol = "-"
+                    else:
+                        symbol = "+"
+
+                    message_list.append(f"{symbol} {note.code} ({note.nom}) {note.note} pts * {note.ECTS} ECTS")
+
+    message_list.append("```")
+    return "\n".join(message_list)
 
 
 class Notes(commands.Cog):
@@ -94,9 +196,15 @@ class Notes(commands.Cog):
         self.ecole_roles = {"Télécom SudParis": 673315145421815848, "Institut Mines-Télécom Business School": 673315006259003393}
         self.refresh_users_ids = [138751484517941259, 673834847470616576]
         self.refresh_users: dict = {}
+        self.poller = AdaptivePoller(bot.config)
         self.bulletins = {}
+        self.bulletins_store = BulletinCache(bot, bot.config.bulletins_cache_path)
         self.notify_notes_loop.start()
-        self.max_downloads = asyncio.Semaphore(6)
+        self.fetcher = FetchScheduler(bot.loop, slots=bot.config.sifi_slots, class_limits={fetch_scheduler.BULK: bot.config.sifi_bulk_slots},
+                                      retries=bot.config.sifi_retries, backoff=bot.config.sifi_backoff,
+                                      class_retries={fetch_scheduler.INTERACTIVE: (bot.config.sifi_interactive_retries, bot.config.sifi_interactive_backoff)})
+        self.downloads: typing.Dict[int, typing.Tuple[asyncio.Task, FetchRequest]] = {}
+        self.download_stats = collections.Counter()
 
     def cog_unload(self):
         self.notify_notes_loop.cancel()
@@ -110,88 +218,84 @@ class Notes(commands.Cog):
             if await self.bot.db.has_profile(member) and member.id not in exceptions:
                 members_with_profile.append(member)
 
-        max_caching_downloads = asyncio.Semaphore(5)  # 5 max downloads for a cache
-
         self.bot.logger.debug(f"[cache_notes_for_role] Starting preemptive cache for {len(members_with_profile)} users...")
 
         async def update_bulletin(user):
-            backoff = 1
-            async with max_caching_downloads:
-                self.bot.logger.debug(f"[cache_notes_for_role] Starting preemptive cache for {user}...")
-                while True:
-                    try:
-                        sleep_time = random.randint(5, 20) * backoff
-                        self.bot.logger.debug(f"[cache_notes_for_role] {user}: sleeping for {sleep_time} seconds to avoid overloading...")
-                        await asyncio.sleep(sleep_time)
-                        await self.get_bulletin(user, force_refresh=True)
-                        self.bot.logger.debug(f"[cache_notes_for_role] Finished preemptive caching for {user}...")
-                        return
-                    except asyncio.TimeoutError:
-                        self.bot.logger.debug(f"[cache_notes_for_role] Timout caching notes for {user}, retrying...")
-                        backoff += 1
-                    except TypeError:
-                        self.bot.logger.debug(f"[cache_notes_for_role] Type error caching notes for {user} (probably due to invalid reply from SIFI, retrying...)")
-                        backoff += 1
-                    except json.decoder.JSONDecodeError:
-                        self.bot.logger.debug(f"[cache_notes_for_role] Json error caching notes for {user} (probably due to SIFI overload, retrying...)")
-                        backoff += 1
+            # The fetch scheduler paces these behind interactive commands, and retries a few times on its own
+            try:
+                await self.get_bulletin(user, force_refresh=True, priority=fetch_scheduler.BULK)
+            except SIFI_ERRORS as e:
+                self.bot.logger.debug(f"[cache_notes_for_role] Giving up caching notes for {user}: {e!r}")
+                return False
+            else:
+                self.bot.logger.debug(f"[cache_notes_for_role] Finished preemptive caching for {user}...")
+                return True
 
         parralel = [update_bulletin(member) for member in members_with_profile]
-        await asyncio.gather(*parralel)
-        return len(parralel)
+        return sum(await asyncio.gather(*parralel))
 
-    async def notify_notes_user(self, user):
-        new_bulletin = await self.get_bulletin(user, True)
+    async def notify_notes_user(self, user) -> bool:
+        new_bulletin = await self.get_bulletin(user, True, priority=fetch_scheduler.WATCHER)
         old_bulletin: Bulletin = self.refresh_users[user]
 
-        if old_bulletin.notes_count != new_bulletin.notes_count:
+        diff = diff_bulletins(old_bulletin, new_bulletin)
+
+        if diff:
             ecole_role = self.alert_notes_channel.guild.get_role(self.ecole_roles[new_bulletin.ecole])
             if not ecole_role:
                 ecole_role = self.alert_notes_channel.guild.default_role
 
-            old_notes = {f"{n['code']} - {n['nom']}" for n in old_bulletin.notes(get_categories=False) if n["note"]}
-            new_notes = {f"{n['code']} - {n['nom']}" for n in new_bulletin.notes(get_categories=False) if n["note"]}
-
-            self.bot.logger.debug(f"Anciennes notes: {old_notes}")
-            self.bot.logger.debug(f"Nouvelles notes: {new_notes}")
-
-            difference = new_notes.symmetric_difference(old_notes)
+            self.bot.logger.debug(f"Changements de notes pour {user.name}: {diff}")
 
-            ajout = old_bulletin.notes_count < new_bulletin.notes_count
+            details = []
+            if diff.added:
+                details.append(f"Ajout de {', '.join(f'{n.code} - {n.nom}' for n in diff.added)}.")
+            if diff.changed:
+                details.append(f"Modification de {', '.join(f'{new.code} - {new.nom} ({old.note} -> {new.note})' for old, new in diff.changed)}.")
+            if diff.removed:
+                details.append(f"Supression de {', '.join(f'{n.code} - {n.nom}' for n in diff.removed)}.")
 
-            if ajout:
+            if diff.added or diff.changed:
                 self.bot.logger.info(f"Nouvelles notes pour {user.name} ({old_bulletin.notes_count} -> {new_bulletin.notes_count})")
                 n = 0
                 if not ecole_role.is_default():
                     try:
                         n = await self.cache_notes_for_role(ecole_role, exceptions=[user.id])
                     except:
-                        self.bot.logger.exception(f"Erreur lors de la sauvegarde des notes: {new_notes}")
+                        self.bot.logger.exception(f"Erreur lors de la sauvegarde des notes: {diff}")
                         pass
                 await self.alert_notes_channel.send(f"Des nouvelles notes ({old_bulletin.notes_count} -> {new_bulletin.notes_count}) sont disponibles :) "
-                                                    f"{ecole_role.mention} [**{new_bulletin.ecole}**]\n"
-                                                    f"Ajout de {', '.join(difference)}.\n"
+                                                    f"{ecole_role.mention} [**{new_bulletin.ecole}**]\n" +
+                                                    "\n".join(details) + "\n" +
                                                     f"{n} notes mises en cache pour accès immédiat.")
 
-
             else:
-                await self.alert_notes_channel.send(f"Des notes ont été supprimées ({old_bulletin.notes_count} -> {new_bulletin.notes_count}) [**{new_bulletin.ecole}**]\n"
-                                                    f"Supression de {', '.join(difference)}")
+                await self.alert_notes_channel.send(f"Des notes ont été supprimées ({old_bulletin.notes_count} -> {new_bulletin.notes_count}) [**{new_bulletin.ecole}**]\n" +
+                                                    "\n".join(details))
 
                 self.bot.logger.info(f"Notes suprimées pour {user.name} ({old_bulletin.notes_count} -> {new_bulletin.notes_count})")
 
             self.refresh_users[user] = new_bulletin
+            return True
         else:
             self.bot.logger.debug(f"Pas de nouvelles notes pour {user.name} ({old_bulletin.notes_count} -> {new_bulletin.notes_count})")
+            return False
 
-    @tasks.loop(minutes=10)
-    async def notify_notes_loop(self):
-        # Execute all of the users in parralel to save time
-        parralel = [self.notify_notes_user(user) for user in self.refresh_users.keys()]
+    async def poll_user(self, user):
+        start = time.perf_counter()
         try:
-            await asyncio.gather(*parralel)
-        except:
-            self.bot.logger.exception("Error in the notify_notes loop. Ignoring and hoping for the best")
+            changed = await self.notify_notes_user(user)
+        except Exception:
+            self.poller.record_failure(user)
+            self.bot.logger.exception(f"Erreur lors de la recherche de nouvelles notes pour {user.name}, prochain essai dans {self.poller.states[user].interval:.0f}s")
+        else:
+            self.poller.record_success(user, time.perf_counter() - start, changed)
+
+    @tasks.loop(seconds=30)
+    async def notify_notes_loop(self):
+        # Each account has its own schedule, see utils/polling.py. Polls run in the background so a slow one doesn't delay the others.
+        for user in self.poller.due():
+            self.bot.loop.create_task(self.poll_user(user))
 
     @notify_notes_loop.before_loop
     async def before_refresh(self):
@@ -202,7 +306,8 @@ class Notes(commands.Cog):
 
         for user_id in self.refresh_users_ids:
             user = self.bot.get_user(user_id)
-            self.refresh_users[user] = await self.get_bulletin(user)
+            self.refresh_users[user] = await self.get_bulletin(user, priority=fetch_scheduler.WATCHER)
+            self.poller.add(user)
 
         self.bot.logger.info(f"Recherche de nouvelles notes lancé :)")
 
@@ -217,19 +322,41 @@ class Notes(commands.Cog):
             raise commands.CommandError()
         return True
 
-    async def get_bulletin_from_api(self, profile: Profile):
-        async with aiohttp.ClientSession() as session:
-            async with session.post('https://notes.api-d.com/sifiQuery.php',
-                                    data={"username": profile.tsp_user, "password": profile.tsp_password}, ) as resp:
-                try:
-                    return Bulletin(profile, await resp.json(content_type=None))
-                except:
-                    text = await resp.text()
-                    self.bot.logger.exception(f"Erreur lors du chargement du bulletin. Voici le HTML retourné par le serveur:\n{text}")
-                    raise
+    async def get_bulletin_from_api(self, profile: Profile) -> typing.Tuple[Bulletin, dict]:
+        """
+        Returns the parsed bulletin, along with the raw SIFI reply it was parsed from.
+        """
+        try:
+            with metrics.UPSTREAM_LATENCY.time(service="sifi"):
+                async with self.bot.session.post(self.bot.config.sifi_url,
+                                                 data={"username": profile.tsp_user, "password": profile.tsp_password}, ) as resp:
+                    try:
+                        retour_sifi = await resp.json(content_type=None)
+                        return Bulletin(profile, retour_sifi), retour_sifi
+                    except:
+                        text = await resp.text()
+                        self.bot.logger.exception(f"Erreur lors du chargement du bulletin. Voici le HTML retourné par le serveur:\n{text}")
+                        raise
+        except Exception:
+            metrics.UPSTREAM_ERRORS.inc(service="sifi")
+            raise
 
     async def get_bulletin_from_cache(self, member) -> typing.Tuple[typing.Optional[int], typing.Optional[Bulletin]]:
         creation, bulletin = self.bulletins.get(member.id, (None, None))
+
+        if not bulletin:
+            # Maybe we downloaded it before a restart
+            creation, retour_sifi = await self.bulletins_store.get(member.id)
+            if retour_sifi:
+                profile = await self.bot.db.get_profile(member)
+                try:
+                    bulletin = Bulletin(profile, retour_sifi)
+                except (KeyError, TypeError, ValueError):
+                    self.bot.logger.exception(f"Bulletin en cache illisible pour {member}, suppression.")
+                    await self.bulletins_store.remove(member.id)
+                    return None, None
+                self.bulletins[member.id] = (creation, bulletin)
+
         return creation, bulletin
 
     async def is_bulletin_in_cache(self, member) -> bool:
@@ -238,23 +365,90 @@ class Notes(commands.Cog):
         if not bulletin or not creation:
             return False
 
-        if creation + (60*60*4) < time.time():
+        if creation + self.bot.config.bulletins_max_age < time.time():
             return False
 
         else:
             return True
 
-    async def get_bulletin(self, member, force_refresh=False) -> Bulletin:
-        async with self.max_downloads:
-            if not force_refresh and await self.is_bulletin_in_cache(member):
+    async def is_bulletin_usable(self, member) -> bool:
+        """
+        Whether a command can reply right away, with a possibly stale bulletin.
+        """
+        creation, bulletin = await self.get_bulletin_from_cache(member)
+
+        if not bulletin or not creation:
+            return False
+
+        return creation + self.bot.config.bulletins_max_age + self.bot.config.bulletins_stale_grace >= time.time()
+
+    def revalidate_bulletin(self, member):
+        """
+        Download a fresh bulletin in the background, unless it's already being done.
+        """
+        if member.id in self.downloads:
+            return
+
+        async def revalidate():
+            try:
+                await self.get_bulletin(member, force_refresh=True, priority=fetch_scheduler.WATCHER)
+            except SIFI_ERRORS as e:
+                self.bot.logger.debug(f"Impossible de rafraichir le bulletin de {member} en arrière plan: {e!r}")
+
+        self.bot.loop.create_task(revalidate())
+
+    async def get_bulletin_or_stale(self, member) -> typing.Tuple[Bulletin, bool]:
+        """
+        Stale-while-revalidate: a bulletin past its max age but within the grace period is returned immediately, and
+        refreshed in the background. Only older bulletins make the caller wait for SIFI.
+
+        Returns the bulletin, and whether it might be stale.
+        """
+        if await self.is_bulletin_in_cache(member):
+            creation, bulletin = await self.get_bulletin_from_cache(member)
+            metrics.BULLETIN_CACHE.inc(result="fresh")
+            return bulletin, False
+
+        if await self.is_bulletin_usable(member):
+            creation, bulletin = await self.get_bulletin_from_cache(member)
+            metrics.BULLETIN_CACHE.inc(result="stale")
+            self.revalidate_bulletin(member)
+            return bulletin, True
+
+        return await self.get_bulletin(member), False
+
+    async def download_bulletin(self, member, request: FetchRequest) -> Bulletin:
+        profile = await self.bot.db.get_profile(member)
+        bulletin, retour_sifi = await self.fetcher.run(request, lambda: self.get_bulletin_from_api(profile), retry_on=SIFI_TRANSIENT_ERRORS)
+        creation = int(time.time())
+        self.bulletins[member.id] = (creation, bulletin)
+        await self.bulletins_store.put(member.id, creation, retour_sifi)
+        return bulletin
+
+    async def get_bulletin(self, member, force_refresh=False, priority=fetch_scheduler.INTERACTIVE) -> Bulletin:
+        if not force_refresh:
+            if await self.is_bulletin_in_cache(member):
                 creation, bulletin = await self.get_bulletin_from_cache(member)
+                metrics.BULLETIN_CACHE.inc(result="fresh")
                 return bulletin
-            else:
-                profile = await self.bot.db.get_profile(member)
-                bulletin = await self.get_bulletin_from_api(profile)
-                creation = int(time.time())
-                self.bulletins[member.id] = (creation, bulletin)
-                return bulletin
+            metrics.BULLETIN_CACHE.inc(result="miss")
+
+        # A download is only ever started because the cache is stale or a fresh bulletin was asked for: whatever the caller
+        # wants, a download that's already running for this member will be at least as fresh, so we wait for it instead.
+        download, request = self.downloads.get(member.id, (None, None))
+        if download is None:
+            request = FetchRequest(priority)
+            download = self.bot.loop.create_task(self.download_bulletin(member, request))
+            self.downloads[member.id] = (download, request)
+            download.add_done_callback(lambda task: self.downloads.pop(member.id) if self.downloads.get(member.id, (None,))[0] is task else None)
+            self.download_stats["downloads"] += 1
+        else:
+            # Someone more urgent may be joining a bulk download still waiting for its turn
+            self.fetcher.promote(request, priority)
+            self.download_stats["coalesced"] += 1
+
+        # Shielded, so that a cancelled command doesn't cancel the download for everyone else.
+        return await asyncio.shield(download)
 
     @commands.group(aliases=["n"])
     @commands.max_concurrency(1, BucketType.user)
@@ -262,11 +456,11 @@ class Notes(commands.Cog):
         """
         Rècupere les notes depuis le serveur et les stocke en cache pendant quelques temps.
         """
-        if not await self.is_bulletin_in_cache(ctx.author):
+        if not await self.is_bulletin_usable(ctx.author):
             await ctx.send_to(f"Je vais chercher vos notes en ligne, merci de patienter...")
 
         async with ctx.typing():
-            await self.get_bulletin(ctx.author)
+            await self.get_bulletin_or_stale(ctx.author)
 
         if not ctx.invoked_subcommand:
             await ctx.send_to(f"Vos notes sont téléchargées. Pour les consulter, tapez {ctx.prefix}help notes")
@@ -276,7 +470,8 @@ class Notes(commands.Cog):
         """
         Supprime vos notes du cache local, afin de les rafraichir à la prochaine commande.
         """
-        self.bulletins.pop(ctx.author.id)
+        self.bulletins.pop(ctx.author.id, None)
+        await self.bulletins_store.remove(ctx.author.id)
         await ctx.send_to(f"👌 Cache de vos notes supprimé.")\
 
     @notes.command(aliases=["m"])
@@ -284,61 +479,34 @@ class Notes(commands.Cog):
         """
         Affiche votre moyenne.
         """
-        bulletin = await self.get_bulletin(ctx.author)
-        await ctx.send_to(f"Votre moyenne actuelle est de {bulletin.moyenne}/20.")
+        bulletin, stale = await self.get_bulletin_or_stale(ctx.author)
+        if bulletin.moyenne is None:
+            await ctx.send_to(f"Vous n'avez pas encore de moyenne." + (STALE_WARNING if stale else ""))
+            return
+        await ctx.send_to(f"Votre moyenne actuelle est de {bulletin.moyenne}/20." + (STALE_WARNING if stale else ""))
 
     @notes.command(aliases=["rg"])
     async def rang(self, ctx: CustomContext):
         """
         Force l'affichage de votre rang.
         """
-        bulletin = await self.get_bulletin(ctx.author)
+        bulletin, stale = await self.get_bulletin_or_stale(ctx.author)
+        if bulletin.rang is None:
+            await ctx.send_to(f"Votre rang n'est pas (encore) disponible." + (STALE_WARNING if stale else ""))
+            return
         rang, nb_etudiants = bulletin.rang
-        await ctx.send_to(f"Votre rang actuel est de {rang}/{nb_etudiants}.")
+        await ctx.send_to(f"Votre rang actuel est de {rang}/{nb_etudiants}." + (STALE_WARNING if stale else ""))
 
     @notes.command(aliases=["res", "resumé", "résumé", "résume"])
     async def resume(self, ctx: CustomContext):
         """
         Grand message résumant votre moyenne, votre rang, et l'ensemble de vos notes par UV.
         """
-        bulletin = await self.get_bulletin(ctx.author)
+        bulletin, stale = await self.get_bulletin_or_stale(ctx.author)
         profile = await self.bot.db.get_profile(ctx.author)
 
-        notes = bulletin.notes()
-
-        if profile.show_rang:
-            rang, nb_etudiants = bulletin.rang
-            rang_msg = f", vous etes classé **{rang}e sur {nb_etudiants}** etudiants"
-        else:
-            rang_msg = ""
-
-        message_list = [
-            f"{bulletin.ecole} — Année scolaire {bulletin.annee_scolaire} — **{bulletin.nom}**",
-            f"Vous avez une moyenne de **{bulletin.moyenne}**{rang_msg}.",
-            "```diff"
-        ]
-
-        for note in notes:
-            if note["note"]:
-                if note['is_category']:
-                    if len(message_list) >= 15:
-                        message_list.append("```")
-                        await ctx.send_to("\n".join(message_list))
-                        message_list = ["```diff"]
-                    message_list.append(f"\n{note['nom']} — Moyenne générale {note['note']} pts")
-                else:
-                    if note['note'] is True:
-                        message_list.append(f"+ {note['code']} ({note['nom']}) {note['ECTS']} ECTS")
-                    else:
-                        if note['note'] < 10:
-                            symbol = "-"
-                        else:
-                            symbol = "+"
-
-                        message_list.append(f"{symbol} {note['code']} ({note['nom']}) {note['note']} pts * {note['ECTS']} ECTS")
-
-        message_list.append("```")
-        await ctx.send_to("\n".join(message_list))
+        # Split in as few messages as possible by ctx.send
+        await ctx.send_to(render_resume(bulletin, profile.show_rang, stale))
 
     @commands.is_owner()
     @commands.command(name="cache_notes_for_role")
@@ -355,6 +523,42 @@ class Notes(commands.Cog):
         await self.cache_notes_for_role(role)
         await ctx.send_to("👌")
 
+    @commands.is_owner()
+    @commands.command(name="notes_stats")
+    async def notes_stats(self, ctx: CustomContext):
+        """
+        Statistiques des téléchargements de bulletins.
+        """
+        lines = [f"{self.download_stats['downloads']} téléchargements, "
+                 f"{self.download_stats['coalesced']} demandes regroupées avec un téléchargement en cours, "
+                 f"{len(self.downloads)} en cours ({self.fetcher.active}/{self.fetcher.slots} places SIFI occupées)."]
+
+        depths = self.fetcher.queue_depths()
+        for priority, name in fetch_scheduler.PRIORITY_NAMES.items():
+            stats = self.fetcher.stats[priority]
+            average_wait = stats.wait_total / stats.waits if stats.waits else 0
+            lines.append(f"**{name}** : {depths[priority]} en attente, {stats.waits} passages (attente moyenne {average_wait:.1f}s, max {stats.wait_max:.1f}s), "
+                         f"{stats.retries} nouveaux essais, {stats.failures} abandons.")
+
+        await ctx.send_to("\n".join(lines))
+
+    @commands.is_owner()
+    @commands.command(name="notes_polling")
+    async def notes_polling(self, ctx: CustomContext):
+        """
+        Affiche quand les comptes surveillés seront vérifiés.
+        """
+        now = time.time()
+        lines = []
+        for user, state in self.poller.next_polls().items():
+            if state.running:
+                next_poll = "en cours"
+            else:
+                next_poll = f"dans {state.next_poll - now:.0f}s"
+            lines.append(f"{user.name} : {next_poll} (intervalle {state.interval:.0f}s, {state.failures} échecs)")
+
+        await ctx.send_to("\n".join(lines) or "Aucun compte surveillé.")
+
     @notes.command()
     async def lsh(self, ctx: CustomContext):
         """
@@ -2,33 +2,30 @@ import asyncio
 import typing
 
 import discord
-import ldap3
 from discord.ext import commands
 from discord.ext.commands.cooldowns import BucketType
-from ldap3 import Connection
 
 from utils.context import CustomContext
+from utils.ldap_client import LDAPClient
 
 if typing.TYPE_CHECKING:
     from utils.bot import CustomBot
 
-LDAP_SERVER = "127.0.0.1"
-server = ldap3.Server(LDAP_SERVER, use_ssl=False)
 
+ROLES_NAMES = {
+    "CL_FI-EI1": 742452544802127875,
+    "CL_FI-EI2": 742452566356656168,
+    "CL_FI-EI3": 742452585390407681,
+    "CL_FI-EI4": 742452604197535955,
+    "CL_FE": 673315006259003393,
+}
 
-def get_login_info(email_or_login):
-    conn = Connection(server, auto_bind=True)
-    if "@" in email_or_login:
-        conn.search(u'ou=People,dc=int-evry,dc=fr', u"(mail={})".format(email_or_login), ldap3.SUBTREE, attributes=ldap3.ALL_ATTRIBUTES)
-    else:
-        conn.search(u'ou=People,dc=int-evry,dc=fr', u"(uid={})".format(email_or_login), ldap3.SUBTREE, attributes=ldap3.ALL_ATTRIBUTES)
-    try:
-        res = conn.entries[0]
-    except IndexError:
-        return None
 
-    return {"mail": str(res["mail"]), "display_name": str(res["givenName"]) + " " + str(res["sn"]), "first_name": str(res["givenName"]), "last_name": str(res["sn"]),
-            "uid": str(res["uid"]), "title": str(res["title"])}
+def get_group_role_id(group: str) -> typing.Optional[int]:
+    for group_name, role_id in ROLES_NAMES.items():
+        if group_name.startswith(group):
+            return role_id
+    return None
 
 
 class NoProfileError(commands.CommandError):
@@ -42,6 +39,10 @@ class Profiles(commands.Cog):
 
     def __init__(self, bot: 'CustomBot'):
         self.bot = bot
+        self.ldap = LDAPClient(bot)
+
+    def cog_unload(self):
+        self.bot.loop.create_task(self.ldap.close())
 
     @commands.group(aliases=["p"])
     async def profile(self, ctx: CustomContext):
@@ -132,39 +133,109 @@ class Profiles(commands.Cog):
 
     @profile.command()
     async def get_roles(self, ctx: CustomContext):
-        count_added = 0
+        progress = await ctx.send("Recherche des profils...")
+
+        # A single read of the storage, rather than one per member
+        profiles = await self.bot.db.get_all_profiles()
+        logins = {}
         for member in ctx.guild.members:
-            try:
-                profile = await self.bot.db.get_profile(member)
-            except KeyError:
-                pass
+            profile = profiles.get(str(member.id))
+            if profile is not None:
+                logins[member] = profile.tsp_user
+
+        await progress.edit(content=f"Recherche de {len(logins)} profils dans le LDAP...")
+        infos = await self.ldap.get_logins_info(logins.values())
+
+        changes = []
+        not_found = 0
+        unknown_group = 0
+        already_set = 0
+        for member, login in logins.items():
+            user_info = infos.get(login.lower())
+            if not user_info:
+                not_found += 1
+                continue
+
+            role = ctx.guild.get_role(get_group_role_id(user_info["title"]))
+            if not role:
+                unknown_group += 1
+            elif role in member.roles:
+                already_set += 1
             else:
-                count_added += await self.set_user_roles(member, profile.tsp_user)
-            await asyncio.sleep(0)
-        await ctx.send(f"{count_added} roles donnés :)")
+                changes.append((member, role, user_info["title"]))
 
-    async def set_user_roles(self, member: discord.Member, user_login: str):
-        ROLES_NAMES = {
-            "CL_FI-EI1": 742452544802127875,
-            "CL_FI-EI2": 742452566356656168,
-            "CL_FI-EI3": 742452585390407681,
-            "CL_FI-EI4": 742452604197535955,
-            "CL_FE": 673315006259003393,
-        }
+        given, failed = await self.apply_roles(changes, progress)
+
+        await progress.edit(content=f"{given} roles donnés :) "
+                                    f"({already_set} déjà en place, {failed} erreurs, {not_found} introuvables dans le LDAP, {unknown_group} groupes inconnus)")
+
+    @commands.is_owner()
+    @profile.group()
+    async def ldap_cache(self, ctx: CustomContext):
+        """
+        Statistiques du cache des recherches LDAP.
+        """
+        if not ctx.invoked_subcommand:
+            stats = self.ldap.cache_stats()
+            await ctx.send_to(f"Cache LDAP : {stats['entries']} entrées, {stats['negative_entries']} logins inconnus. "
+                              f"{stats['hits']} hits, {stats['negative_hits']} hits négatifs, {stats['misses']} recherches LDAP.")
 
-        user_info = get_login_info(user_login)
+    @ldap_cache.command(name="clear")
+    async def ldap_cache_clear(self, ctx: CustomContext, login: str = None):
+        """
+        Vide le cache LDAP, pour un login ou entièrement.
+        """
+        self.ldap.invalidate(login)
+        await ctx.send_to("👌 Cache LDAP vidé.")
+
+    async def apply_roles(self, changes: typing.List[typing.Tuple[discord.Member, discord.Role, str]], progress: discord.Message) -> typing.Tuple[int, int]:
+        """
+        Give the roles with a few workers, and report the progress in the given message. discord.py waits out the rate limits.
+        """
+        queue = asyncio.Queue()
+        for change in changes:
+            queue.put_nowait(change)
+
+        counts = {"given": 0, "failed": 0}
+
+        async def worker():
+            while not queue.empty():
+                member, role, group = queue.get_nowait()
+                try:
+                    await member.add_roles(role, reason=f"Giving role for {group} in ldap.")
+                except discord.HTTPException as e:
+                    self.bot.logger.warning(f"[get_roles] Couldn't give {role} to {member}: {e}")
+                    counts["failed"] += 1
+                else:
+                    counts["given"] += 1
+
+        async def report_progress():
+            while True:
+                await asyncio.sleep(self.bot.config.roles_progress_interval)
+                try:
+                    await progress.edit(content=f"Attribution des roles... {counts['given'] + counts['failed']}/{len(changes)}")
+                except discord.HTTPException as e:
+                    self.bot.logger.warning(f"[get_roles] Couldn't update the progress message: {e}")
+
+        reporter = self.bot.loop.create_task(report_progress())
+        try:
+            await asyncio.gather(*[worker() for _ in range(self.bot.config.roles_workers)])
+        finally:
+            reporter.cancel()
+
+        return counts["given"], counts["failed"]
+
+    async def set_user_roles(self, member: discord.Member, user_login: str):
+        user_info = await self.ldap.get_login_info(user_login)
 
         if not user_info:
             print(f"No valid user for {user_login} ({member.mention})")
             return False
 
         group = user_info["title"]
+        role_id = get_group_role_id(group)
 
-
-        for group_name, role_id in ROLES_NAMES.items():
-            if group_name.startswith(group):
-                break
-        else:
+        if not role_id:
             print(f"Unknown group {group} for user {user_login} ({member.mention})")
 
             return False
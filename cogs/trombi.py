@@ -1,23 +1,175 @@
 # https://trombi.imtbs-tsp.eu/photo.php?uid=jovart_a&h=320&w=240
 
+import asyncio
+import io
 import typing
 
-import aiohttp
 import discord
-from discord.ext import commands
+from discord.ext import commands, tasks
 from discord.ext.commands.cooldowns import BucketType
+from utils import metrics
+from utils.cache import MISSING, TTLCache
 from utils.context import CustomContext
+from utils.people_directory import PeopleDirectory
+from utils.photo_cache import PhotoCache
 
 if typing.TYPE_CHECKING:
     from utils.bot import CustomBot
 
 
+def normalize_query(search_term: str) -> str:
+    """
+    Searches differing only by case or spacing share the same results.
+    """
+    return " ".join(search_term.casefold().split())
+
+
+def has_next_page(users: dict, page: int, page_size: int) -> bool:
+    # When the number of pages isn't given, the last page is the first one that isn't full
+    pages = users.get("pages")
+    if pages is not None:
+        return page < pages
+    return len(users["people"]) >= page_size
+
+
+def format_search_results(users: dict, page: int = 1) -> str:
+    if page > 1:
+        users_formatted = [f"**Résultats de votre recherche (page {page}) :**\n"]
+    else:
+        users_formatted = ["**Résultats de votre recherche :**\n"]
+    for user in users['people']:
+        out_year = user.get('year_out', '')
+        if out_year is None:
+            out_year = ''
+
+        users_formatted.append(f"[{user['login']}] **{user['last_name']} {user['first_name']}** ({user['profession']}) - "
+                               f"{user['email']} {user['year_entrance']}-{out_year} <https://trombi.minet.net/pictures/{user['picture_src']}.jpg>")
+
+    return "\n".join(users_formatted)
+
+
 class Trombi(commands.Cog):
     """
     Recherches dans le trombi de l'école (grace au trombi de MiNet)
     """
     def __init__(self, bot: 'CustomBot'):
         self.bot = bot
+        # (normalized query, page) -> API reply
+        self.results = TTLCache(bot.config.trombi_cache_ttl, maxsize=bot.config.trombi_cache_size)
+        self.fetches: typing.Dict[typing.Tuple[str, int], asyncio.Task] = {}
+        # member ID -> (normalized query, page), for the next command
+        self.last_searches = TTLCache(bot.config.trombi_cache_ttl)
+        self.directory = PeopleDirectory(bot)
+        self.photos = PhotoCache(bot)
+        self.sync_people_loop.start()
+
+    def cog_unload(self):
+        self.sync_people_loop.cancel()
+        self.directory.close()
+        self.bot.loop.create_task(self.photos.close())
+
+    async def flush(self):
+        """
+        Called by the bot as it closes, so that the photos cached since the last save are still known after a restart.
+        """
+        if not self.photos.closed:
+            await self.photos.save()
+
+    @tasks.loop(minutes=5)
+    async def sync_people_loop(self):
+        if self.directory.stale():
+            try:
+                await self.directory.sync()
+            except Exception:
+                self.bot.logger.exception("Erreur lors de la synchronisation du trombi, prochain essai dans 5 minutes.")
+
+    @sync_people_loop.before_loop
+    async def before_sync_people(self):
+        # Searches can use the copy from before the restart while the bot connects
+        await self.directory.load()
+        await self.bot.wait_until_ready()
+
+    async def search_people(self, search_term: str, page: int = 1) -> dict:
+        #  https://trombi.minet.net/developer#people-search
+        # https://trombi.minet.net/api/v1/people/search?q=jovart&type=n&page=1
+        try:
+            with metrics.UPSTREAM_LATENCY.time(service="trombi"):
+                async with self.bot.session.get(self.bot.config.trombi_search_url, params={"q": search_term, "type": "n", "page": page}) as resp:
+                    try:
+                        return await resp.json()
+                    except:
+                        text = await resp.text()
+                        self.bot.logger.exception(f"Erreur lors du chargement du trombi. Voici le HTML retourné par le serveur:\n{text}")
+                        raise
+        except Exception:
+            metrics.UPSTREAM_ERRORS.inc(service="trombi")
+            raise
+
+    async def fetch_search_page(self, query: str, page: int) -> dict:
+        users = await self.search_people(query, page)
+        self.results.set((query, page), users)
+        return users
+
+    def start_fetch(self, query: str, page: int) -> asyncio.Task:
+        """
+        Download a page of results, unless it's already being done.
+        """
+        key = (query, page)
+        fetch = self.fetches.get(key)
+        if fetch is None:
+            fetch = self.bot.loop.create_task(self.fetch_search_page(query, page))
+            self.fetches[key] = fetch
+            fetch.add_done_callback(lambda task: self.fetches.pop(key, None))
+        return fetch
+
+    async def get_search_page(self, query: str, page: int) -> dict:
+        """
+        A page of results for a normalized query. Many people searching for the same person at once make a single request.
+        """
+        if self.directory.usable():
+            metrics.TROMBI_CACHE.inc(result="index")
+            return self.directory.search_page(query, page)
+
+        users = self.results.get((query, page))
+        if users is not MISSING:
+            metrics.TROMBI_CACHE.inc(result="hit")
+            return users
+
+        metrics.TROMBI_CACHE.inc(result="coalesced" if (query, page) in self.fetches else "miss")
+
+        # Shielded, so that a cancelled command doesn't cancel the request for everyone else.
+        return await asyncio.shield(self.start_fetch(query, page))
+
+    def prefetch(self, query: str, page: int, users: dict):
+        """
+        Download the next pages in the background, all at once, so that paging forward is answered from the cache.
+        """
+        if self.directory.usable() or not has_next_page(users, page, self.bot.config.trombi_search_page_size):
+            return
+
+        if users.get("pages") is not None:
+            last_page = min(page + self.bot.config.trombi_prefetch_pages, users["pages"])
+        else:
+            # Any page after the next one may well be empty
+            last_page = page + 1
+
+        for next_page in range(page + 1, last_page + 1):
+            if (query, next_page) not in self.results and (query, next_page) not in self.fetches:
+                self.start_fetch(query, next_page).add_done_callback(self.prefetch_done)
+
+    def prefetch_done(self, task: asyncio.Task):
+        # Nobody may ever ask for that page, so errors are logged here
+        if not task.cancelled() and task.exception() is not None:
+            self.bot.logger.debug(f"[trombi] Prefetching a page of results failed: {task.exception()!r}")
+
+    async def send_page(self, ctx: CustomContext, query: str, page: int, users: dict):
+        self.last_searches.set(ctx.author.id, (query, page))
+        self.prefetch(query, page, users)
+
+        message = format_search_results(users, page)
+        if has_next_page(users, page, self.bot.config.trombi_search_page_size):
+            message += f"\n\nPage suivante : `{ctx.prefix}trombi next`"
+        await ctx.send_to(message)
 
     @commands.group(aliases=["t"])
     async def trombi(self, ctx: CustomContext):
@@ -32,40 +184,64 @@ class Trombi(commands.Cog):
         """
         Recherche d'une personne sur le trombi
         """
-        #  https://trombi.minet.net/developer#people-search
+        query = normalize_query(search_term)
+        users = await self.get_search_page(query, 1)
+        await self.send_page(ctx, query, 1, users)
+
+    @trombi.command(name="next", aliases=["n", "suivant"])
+    async def next_page(self, ctx: CustomContext):
+        """
+        Page suivante des résultats de votre dernière recherche
+        """
+        last_search = self.last_searches.get(ctx.author.id)
+        if last_search is MISSING:
+            await ctx.send_to(f"Vous n'avez pas fait de recherche récemment. Utilisez {ctx.prefix}trombi search nom")
+            return
 
-        async with aiohttp.ClientSession() as session:
-            async with session.get('https://trombi.minet.net/api/v1/people/search', params={"q": search_term, "type": "n"}) as resp:
-                try:
-                    users = await resp.json()
-                except:
-                    text = await resp.text()
-                    self.bot.logger.exception(f"Erreur lors du chargement du trombi. Voici le HTML retourné par le serveur:\n{text}")
-                    raise
+        query, page = last_search
+        users = await self.get_search_page(query, page + 1)
+        if not users["people"]:
+            await ctx.send_to("Il n'y a pas d'autres résultats.")
+            return
 
-        users_formatted = ["**Résultats de votre recherche :**\n"]
-        for user in users['people']:
-            out_year = user.get('year_out', '')
-            if out_year is None:
-                out_year = ''
+        await self.send_page(ctx, query, page + 1, users)
 
-            users_formatted.append(f"[{user['login']}] **{user['last_name']} {user['first_name']}** ({user['profession']}) - "
-                                   f"{user['email']} {user['year_entrance']}-{out_year} <https://trombi.minet.net/pictures/{user['picture_src']}.jpg>")
+    @commands.is_owner()
+    @trombi.command(name="sync")
+    async def sync_people(self, ctx: CustomContext, full: bool = False):
+        """
+        Synchronise la copie locale du trombi
+        """
+        await ctx.send_to(f"Synchronisation {'complète ' if full else ''}du trombi en cours...")
+        await self.directory.sync(full=full)
+        await ctx.send_to(f"👌 {len(self.directory.index)} personnes dans la copie locale du trombi.")
 
-        await ctx.send_to("\n".join(users_formatted))
+    async def send_photo(self, ctx: CustomContext, uid: str, message: str = ""):
+        width, height = self.bot.config.trombi_photo_size
+        try:
+            async with ctx.typing():
+                photo = await self.photos.get(uid, width, height)
+        except Exception as e:
+            # Still useful to people logged in to the CAS
+            ctx.logger.debug(f"Impossible de télécharger la photo de {uid}: {e!r}")
+            await ctx.send_to(f"{message} https://trombi.imtbs-tsp.eu/photo.php?uid={uid}".strip())
+            return
 
-        # https://trombi.minet.net/api/v1/people/search?q=jovart&type=n&page=1
+        if photo is None:
+            await ctx.send_to(f"Pas de photo pour {uid} :(")
+        else:
+            await ctx.send_to(message or uid, file=discord.File(io.BytesIO(photo), filename=f"{uid}.jpg"))
 
     @trombi.command(aliases=["p"])
     async def photo(self, ctx: CustomContext, target_username: str = None):
         """
-        Lien vers la photo d'un certain nom d'utilisateur. Vous devez etre connecté au CAS.
+        Photo d'un certain nom d'utilisateur, ou la votre.
         """
         if target_username:
-            await ctx.send_to(f"https://trombi.imtbs-tsp.eu/photo.php?uid={target_username}")
+            await self.send_photo(ctx, target_username)
         elif await self.bot.db.has_profile(ctx.author):
             profile = await self.bot.db.get_profile(ctx.author)
-            await ctx.send_to(f"Votre jolie photo : https://trombi.imtbs-tsp.eu/photo.php?uid={profile.tsp_user}")
+            await self.send_photo(ctx, profile.tsp_user, "Votre jolie photo :")
         else:
             await ctx.send_to(f"Veuillez préciser un nom d'utilisateur...")
 
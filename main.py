@@ -1,71 +1,75 @@
 # Setting up asyncio to use uvloop if possible, a faster implementation on the event loop
 import asyncio
 
-try:
-    # noinspection PyUnresolvedReferences
-    import uvloop
-except ImportError:
-    print("Using the not-so-fast default asyncio event loop. Consider installing uvloop.")
-    pass
-else:
-    print("Using the fast uvloop asyncio event loop")
-    asyncio.set_event_loop_policy(uvloop.EventLoopPolicy())
+# The worker processes exporting BBB slides are spawned, and import this module: they mustn't start another bot.
+if __name__ == "__main__":
+    try:
+        # noinspection PyUnresolvedReferences
+        import uvloop
+    except ImportError:
+        print("Using the not-so-fast default asyncio event loop. Consider installing uvloop.")
+        pass
+    else:
+        print("Using the fast uvloop asyncio event loop")
+        asyncio.set_event_loop_policy(uvloop.EventLoopPolicy())
+
+    print("Loading...")
+
+    # Importing the discord API warpper
 
-print("Loading...")
+    print("Loading discord...")
+    import discord
 
-# Importing the discord API warpper
+    print("Import bot...")
+    from utils.bot import CustomBot
 
-print("Loading discord...")
-import discord
+    print("Creating bot...")
+    bot = CustomBot(case_insensitive=True)
+    logger = bot.logger
 
-print("Import bot...")
-from utils.bot import CustomBot
+    logger.info("Created logger!")
 
-print("Creating bot...")
-bot = CustomBot(case_insensitive=True)
-logger = bot.logger
 
-logger.info("Created logger!")
 
+    logger.debug("Loading cogs : ")
 
+    ######################
+    #                 |  #
+    #   ADD COGS HERE |  #
+    #                 V  #
+    # ###############   ##
 
-logger.debug("Loading cogs : ")
+    cogs = ['jishaku',
+            'cogs.error_handling',
+            'cogs.moodle',
+            'cogs.monitoring',
+            'cogs.notes',
+            'cogs.profile',
+            'cogs.trombi',
+            ]
 
-######################
-#                 |  #
-#   ADD COGS HERE |  #
-#                 V  #
-# ###############   ##
+    for extension in cogs:
+        try:
+            bot.load_extension(extension)
+            logger.debug(f"> {extension} loaded!")
+        except Exception as e:
+            logger.exception('> Failed to load extension {}\n{}: {}'.format(extension, type(e).__name__, e))
 
-cogs = ['jishaku',
-        'cogs.error_handling',
-        'cogs.moodle',
-        'cogs.notes',
-        'cogs.profile',
-        'cogs.trombi',
-        ]
+    logger.info("Everything seems fine, we are now connecting to discord.")
 
-for extension in cogs:
     try:
-        bot.load_extension(extension)
-        logger.debug(f"> {extension} loaded!")
-    except Exception as e:
-        logger.exception('> Failed to load extension {}\n{}: {}'.format(extension, type(e).__name__, e))
-
-logger.info("Everything seems fine, we are now connecting to discord.")
-
-try:
-    # bot.loop.set_debug(True)
-    bot.loop.run_until_complete(bot.start(bot.token))
-except KeyboardInterrupt:
-    pass
-finally:
-    logger.warning("Quitting -- Bye")
-    game = discord.Game(name=f"Restarting...")
-    bot.loop.run_until_complete(bot.change_presence(status=discord.Status.dnd, activity=game))
-
-    bot.loop.run_until_complete(bot.logout())
-
-    bot.loop.run_until_complete(asyncio.sleep(3))
-    bot.loop.close()
-    logger.warning("Exited -- Bye")
\ No newline at end of file
+        # bot.loop.set_debug(True)
+        bot.loop.run_until_complete(bot.start(bot.token))
+    except KeyboardInterrupt:
+        pass
+    finally:
+        logger.warning("Quitting -- Bye")
+        game = discord.Game(name=f"Restarting...")
+        bot.loop.run_until_complete(bot.change_presence(status=discord.Status.dnd, activity=game))
+
+        bot.loop.run_until_complete(bot.logout())
+        bot.loop.run_until_complete(bot.close_session())
+
+        bot.loop.run_until_complete(asyncio.sleep(3))
+        bot.loop.close()
+        logger.warning("Exited -- Bye")
\ No newline at end of file
@@ -0,0 +1,47 @@
+import copy
+import json
+import os
+
+from cogs.notes import Bulletin, diff_bulletins
+from utils.storage import Profile
+
+FIXTURE = os.path.join(os.path.dirname(__file__), os.pardir, "benchmarks", "fixtures", "sifi_bulletin.json")
+PROFILE = Profile({"tsp_user": "student", "tsp_password": "hunter2"})
+
+
+def load_retour_sifi() -> dict:
+    with open(FIXTURE, "r") as f:
+        return json.load(f)
+
+
+def with_grade(retour_sifi: dict, code: str, grade) -> Bulletin:
+    retour_sifi = copy.deepcopy(retour_sifi)
+    group = retour_sifi["list1"]["list1_Details_Group_Collection"]["list1_Details_Group"]
+    for matiere_sifi in group["table2"]["Detail_Collection"]["Detail"]:
+        attributes = matiere_sifi["@attributes"]
+        if attributes["textbox38"] == code:
+            if grade is None:
+                attributes.pop("textbox52", None)
+            else:
+                attributes["textbox52"] = grade
+    return Bulletin(PROFILE, retour_sifi)
+
+
+def test_grade_changed_to_zero():
+    retour_sifi = load_retour_sifi()
+    diff = diff_bulletins(with_grade(retour_sifi, "1104-STA", "12.98"), with_grade(retour_sifi, "1104-STA", "0.00"))
+    assert [(old.note, new.note) for old, new in diff.changed] == [(12.98, 0.0)]
+    assert not diff.added and not diff.removed
+
+
+def test_new_zero_grade_is_added():
+    retour_sifi = load_retour_sifi()
+    diff = diff_bulletins(with_grade(retour_sifi, "1103-ALG", None), with_grade(retour_sifi, "1103-ALG", "0.00"))
+    assert [note.code for note in diff.added] == ["1103-ALG"]
+    assert not diff.changed and not diff.removed
+
+
+def test_removed_grade():
+    retour_sifi = load_retour_sifi()
+    diff = diff_bulletins(with_grade(retour_sifi, "1101-ANA", "12.23"), with_grade(retour_sifi, "1101-ANA", None))
+    assert [note.code for note in diff.removed] == ["1101-ANA"]
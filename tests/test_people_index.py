@@ -0,0 +1,33 @@
+from utils.people_index import PeopleIndex
+
+PEOPLE = [
+    {"login": "dupont_b", "first_name": "Bernadette", "last_name": "Dupont"},
+    {"login": "martin_l", "first_name": "Léa", "last_name": "Martin"},
+]
+
+
+def logins(results):
+    return [person["login"] for person in results]
+
+
+def test_prefix_and_accents():
+    index = PeopleIndex(PEOPLE)
+    assert logins(index.search("lea mart")) == ["martin_l"]
+
+
+def test_one_typo():
+    index = PeopleIndex(PEOPLE)
+    assert logins(index.search("matrin")) == ["martin_l"]
+
+
+def test_two_substitutions_in_a_long_word():
+    index = PeopleIndex(PEOPLE)
+    assert logins(index.search("bernodetta")) == ["dupont_b"]
+
+
+def test_two_typos_after_removal_and_update():
+    index = PeopleIndex(PEOPLE)
+    index.remove(["dupont_b"])
+    assert index.search("bernodetta") == []
+    index.update(PEOPLE[:1])
+    assert logins(index.search("bernodetta")) == ["dupont_b"]
@@ -0,0 +1,44 @@
+import asyncio
+import json
+import logging
+import types
+
+from utils.config import Config
+from utils.storage import JsonStorage, Profile, read_json_profiles
+
+
+class FakeConfig(Config):
+    profiles_compaction_records = 1000
+
+
+def make_storage(tmp_path, loop) -> JsonStorage:
+    config = FakeConfig()
+    config.profiles_path = str(tmp_path / "profiles.json")
+    config.profiles_journal_path = str(tmp_path / "profiles.journal")
+    bot = types.SimpleNamespace(config=config, loop=loop, logger=logging.getLogger("test"))
+    return JsonStorage(bot)
+
+
+def test_append_after_torn_journal_is_replayed(tmp_path):
+    (tmp_path / "profiles.json").write_text(json.dumps({"1": {"tsp_user": "a", "tsp_password": "p"}}))
+    record = {"op": "set", "id": "2", "profile": {"tsp_user": "b", "tsp_password": "p"}}
+    # A crash in the middle of an append: no trailing newline
+    (tmp_path / "profiles.journal").write_text(json.dumps(record) + "\n" + '{"op": "set", "id": "3", "profile": {"tsp_user": "x"')
+
+    loop = asyncio.new_event_loop()
+    try:
+        storage = make_storage(tmp_path, loop)
+        member = types.SimpleNamespace(id=4)
+        loop.run_until_complete(storage.save_profile(member, Profile({"tsp_user": "d", "tsp_password": "p"})))
+        # Without compacting, so that the journal is replayed
+        storage._compaction_task.cancel()
+        storage._journal.close()
+        storage._executor.shutdown(wait=True)
+        loop.run_until_complete(asyncio.sleep(0))
+    finally:
+        loop.close()
+
+    profiles, _, corrupted = read_json_profiles(str(tmp_path / "profiles.json"), str(tmp_path / "profiles.journal"))
+    assert corrupted == []
+    assert set(profiles) == {"1", "2", "4"}
+    assert profiles["4"]["tsp_user"] == "d"
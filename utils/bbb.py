@@ -0,0 +1,307 @@
+import asyncio
+import concurrent.futures
+import multiprocessing
+import os
+import re
+import shutil
+import tempfile
+import typing
+import urllib.parse
+from xml.etree import ElementTree
+
+from utils import metrics
+
+MEETING_ID_REGEX = re.compile(r"[0-9a-f]{40}-[0-9]{13}")
+
+SVG_NAMESPACE = "{http://www.w3.org/2000/svg}"
+XLINK_NAMESPACE = "{http://www.w3.org/1999/xlink}"
+
+
+class BBBError(Exception):
+    """
+    The recording can't be exported. The message is shown to the user.
+    """
+    pass
+
+
+class Slide(typing.NamedTuple):
+    href: str  # relative to the recording, e.g. presentation/<id>/slide-1.png
+    start: float  # seconds into the recording when it's first shown
+
+
+def parse_recording_url(url: str) -> typing.Tuple[str, str]:
+    """
+    The base URL of a recording's files, and its meeting ID, from any link to it (playback page, slides...).
+    """
+    parsed = urllib.parse.urlparse(url)
+    match = MEETING_ID_REGEX.search(url)
+    if not parsed.scheme or not parsed.netloc or not match:
+        raise BBBError("Ce lien ne ressemble pas à un enregistrement BigBlueButton.")
+
+    meeting_id = match.group(0)
+    return f"{parsed.scheme}://{parsed.netloc}/presentation/{meeting_id}/", meeting_id
+
+
+def parse_shapes(shapes_svg: bytes) -> typing.List[Slide]:
+    """
+    The slides shown during a recording, from its shapes.svg, in the order they were first shown.
+    """
+    try:
+        root = ElementTree.fromstring(shapes_svg)
+    except ElementTree.ParseError as e:
+        raise BBBError("Les informations de l'enregistrement sont illisibles.") from e
+
+    slides = {}
+    for image in root.iter(f"{SVG_NAMESPACE}image"):
+        href = image.get(f"{XLINK_NAMESPACE}href", "")
+        # Screen sharing is shown with a placeholder image
+        if not href.startswith("presentation/") or href.endswith("deskshare.png"):
+            continue
+        start = float(image.get("in", 0))
+        if href not in slides or start < slides[href].start:
+            slides[href] = Slide(href, start)
+
+    return sorted(slides.values(), key=lambda slide: slide.start)
+
+
+def build_pdf(image_paths: typing.List[str], output_path: str):
+    """
+    Assemble the images into a PDF, one per page. Runs in a worker process, as it's CPU bound.
+    """
+    from PIL import Image
+
+    pages = []
+    for image_path in image_paths:
+        with Image.open(image_path) as image:
+            if image.mode in ("RGBA", "LA", "P"):
+                # PDF pages have no transparency, slides are drawn on white
+                image = image.convert("RGBA")
+                background = Image.new("RGB", image.size, (255, 255, 255))
+                background.paste(image, mask=image.split()[-1])
+                pages.append(background)
+            else:
+                pages.append(image.convert("RGB"))
+
+    pages[0].save(output_path, "PDF", save_all=True, append_images=pages[1:])
+
+
+def write_file(path: str, data: bytes):
+    with open(path, "wb") as f:
+        f.write(data)
+
+
+def remove_file(path: str):
+    try:
+        os.remove(path)
+    except FileNotFoundError:
+        pass
+
+
+class ExportProgress:
+    def __init__(self):
+        self.stage = "Récupération des informations de l'enregistrement"
+        self.done = 0
+        self.total = 0
+
+    def __str__(self):
+        if self.total:
+            return f"{self.stage}... {self.done}/{self.total}"
+        return f"{self.stage}..."
+
+
+class SlidesExporter:
+    """
+    Turns a BigBlueButton recording into a PDF of its slides: the list of slides is read from the recording's shapes.svg,
+    the images are downloaded a few at once, and the PDF is assembled by a pool of worker processes.
+    """
+    def __init__(self, bot):
+        self.bot = bot
+        self.config = bot.config
+        self._processes: typing.Optional[concurrent.futures.ProcessPoolExecutor] = None
+
+    @property
+    def processes(self) -> concurrent.futures.ProcessPoolExecutor:
+        if self._processes is None:
+            # Forking would copy a process running threads (logging, loop monitor, executors) along with their locks
+            self._processes = concurrent.futures.ProcessPoolExecutor(max_workers=self.config.bbb_pdf_workers,
+                                                                     mp_context=multiprocessing.get_context("spawn"))
+        return self._processes
+
+    async def _get(self, url: str) -> bytes:
+        try:
+            with metrics.UPSTREAM_LATENCY.time(service="bbb"):
+                async with self.bot.session.get(url) as resp:
+                    if resp.status == 404:
+                        raise BBBError("Cet enregistrement n'existe pas, ou n'est plus disponible.")
+                    resp.raise_for_status()
+                    return await resp.read()
+        except BBBError:
+            raise
+        except Exception:
+            metrics.UPSTREAM_ERRORS.inc(service="bbb")
+            raise
+
+    async def _download_slides(self, base_url: str, slides: typing.List[Slide], directory: str, progress: ExportProgress) -> typing.List[str]:
+        semaphore = asyncio.Semaphore(self.config.bbb_download_concurrency)
+
+        async def download(number: int, slide: Slide) -> str:
+            async with semaphore:
+                data = await self._get(urllib.parse.urljoin(base_url, slide.href))
+
+            path = os.path.join(directory, f"{number:04d}{os.path.splitext(slide.href)[1]}")
+            await self.bot.loop.run_in_executor(None, write_file, path, data)
+            progress.done += 1
+            return path
+
+        return await asyncio.gather(*[download(number, slide) for number, slide in enumerate(slides)])
+
+    async def export(self, url: str, output_path: str, progress: typing.Optional[ExportProgress] = None) -> int:
+        """
+        Write the slides of the recording to output_path, and return how many there are.
+        """
+        if progress is None:
+            progress = ExportProgress()
+
+        base_url, meeting_id = parse_recording_url(url)
+        slides = parse_shapes(await self._get(urllib.parse.urljoin(base_url, "shapes.svg")))
+        if not slides:
+            raise BBBError("Aucune slide n'a été montrée pendant cet enregistrement.")
+        slides = slides[:self.config.bbb_max_slides]
+
+        directory = tempfile.mkdtemp(prefix=f"bbb-{meeting_id}-")
+        try:
+            progress.stage, progress.total = "Téléchargement des slides", len(slides)
+            image_paths = await self._download_slides(base_url, slides, directory, progress)
+
+            progress.stage, progress.done, progress.total = "Création du PDF", 0, 0
+            await self.bot.loop.run_in_executor(self.processes, build_pdf, image_paths, output_path)
+        finally:
+            await self.bot.loop.run_in_executor(None, shutil.rmtree, directory, True)
+
+        return len(slides)
+
+    def close(self):
+        if self._processes is not None:
+            self._processes.shutdown(wait=False)
+
+
+class PdfCache:
+    """
+    Exported PDFs kept on disk, one per meeting ID. The least recently used are removed past max_bytes.
+    """
+    def __init__(self, bot, path: str, max_bytes: int):
+        self.bot = bot
+        self.path = path
+        self.max_bytes = max_bytes
+
+    def file_path(self, meeting_id: str) -> str:
+        return os.path.join(self.path, f"{meeting_id}.pdf")
+
+    def _get_sync(self, meeting_id: str) -> typing.Optional[str]:
+        file_path = self.file_path(meeting_id)
+        try:
+            # The modification time tells which PDFs were used last
+            os.utime(file_path)
+        except FileNotFoundError:
+            return None
+        return file_path
+
+    def _put_sync(self, meeting_id: str, temp_path: str):
+        file_path = self.file_path(meeting_id)
+        os.replace(temp_path, file_path)
+
+        files = []
+        for name in os.listdir(self.path):
+            if name.endswith(".pdf") and name != os.path.basename(file_path):
+                stat = os.stat(os.path.join(self.path, name))
+                files.append((stat.st_mtime, stat.st_size, name))
+
+        total_bytes = os.path.getsize(file_path) + sum(size for _, size, _ in files)
+        for _, size, name in sorted(files):
+            if total_bytes <= self.max_bytes:
+                break
+            os.remove(os.path.join(self.path, name))
+            total_bytes -= size
+
+    async def get(self, meeting_id: str) -> typing.Optional[str]:
+        return await self.bot.loop.run_in_executor(None, self._get_sync, meeting_id)
+
+    def temp_path(self, meeting_id: str) -> str:
+        os.makedirs(self.path, exist_ok=True)
+        return self.file_path(meeting_id) + ".tmp"
+
+    async def put(self, meeting_id: str, temp_path: str):
+        await self.bot.loop.run_in_executor(None, self._put_sync, meeting_id, temp_path)
+
+
+class ExportJob:
+    def __init__(self, url: str, meeting_id: str, loop: asyncio.AbstractEventLoop):
+        self.url = url
+        self.meeting_id = meeting_id
+        self.progress = ExportProgress()
+        self.future: asyncio.Future = loop.create_future()
+        self.started = False
+        self.requesters = 0
+
+
+class ExportQueue:
+    """
+    Slides exports waiting for one of a few workers. Everyone asking for the same recording shares the same job,
+    and finished PDFs are cached, so a link shared in a class channel is only exported once.
+    """
+    def __init__(self, bot, exporter: SlidesExporter):
+        self.bot = bot
+        self.config = bot.config
+        self.exporter = exporter
+        self.cache = PdfCache(bot, self.config.bbb_cache_path, self.config.bbb_cache_max_bytes)
+
+        self.jobs: typing.Dict[str, ExportJob] = {}
+        self.pending: typing.List[ExportJob] = []
+        self._queue: asyncio.Queue = asyncio.Queue()
+        self._workers: typing.List[asyncio.Task] = []
+
+    def position(self, job: ExportJob) -> int:
+        """
+        1 for the next job to start, 0 once started.
+        """
+        return self.pending.index(job) + 1 if job in self.pending else 0
+
+    def submit(self, url: str, meeting_id: str) -> ExportJob:
+        job = self.jobs.get(meeting_id)
+        if job is None:
+            job = ExportJob(url, meeting_id, self.bot.loop)
+            self.jobs[meeting_id] = job
+            self.pending.append(job)
+            self._queue.put_nowait(job)
+
+            if not self._workers:
+                self._workers = [self.bot.loop.create_task(self._worker()) for _ in range(self.config.bbb_export_workers)]
+
+        job.requesters += 1
+        return job
+
+    async def _worker(self):
+        while True:
+            job = await self._queue.get()
+            self.pending.remove(job)
+            job.started = True
+            temp_path = self.cache.temp_path(job.meeting_id)
+            try:
+                count = await self.exporter.export(job.url, temp_path, job.progress)
+                await self.cache.put(job.meeting_id, temp_path)
+            except asyncio.CancelledError:
+                job.future.cancel()
+                raise
+            except Exception as e:
+                await self.bot.loop.run_in_executor(None, remove_file, temp_path)
+                job.future.set_exception(e)
+                # Retrieved here, as every requester may have given up waiting
+                job.future.exception()
+            else:
+                job.future.set_result((self.cache.file_path(job.meeting_id), count))
+            finally:
+                del self.jobs[job.meeting_id]
+
+    def close(self):
+        for worker in self._workers:
+            worker.cancel()
@@ -1,52 +1,142 @@
 import collections
 import json
 import datetime
+import time
 import traceback
 
+import aiohttp
 import discord
 import typing
 from discord.ext import commands
 
-from utils import context
+from utils import context, metrics
 from utils.config import Config
 from utils.logger import FakeLogger
-from utils.storage import Storage
+from utils.loop_monitor import LoopMonitor
+from utils.output import Output
+from utils.storage import get_storage
 
 
-async def get_prefix(bot: 'CustomBot', message: discord.Message):
-    forced_prefixes = [";"]
+PREFIXES = (";",)
+
 
-    if not message.guild:
-        return commands.when_mentioned_or(*forced_prefixes)(bot, message)
+def compile_prefixes(user_id: int) -> typing.Tuple[str, ...]:
+    """
+    Every prefix a command can start with: the text ones, then the mentions of the bot (as commands.when_mentioned does).
+    """
+    return PREFIXES + (f"<@{user_id}> ", f"<@!{user_id}> ")
 
-    prefix_set = ";"
-    extras = [prefix_set] + forced_prefixes
 
-    return commands.when_mentioned_or(*extras)(bot, message)
+async def get_prefix(bot: 'CustomBot', message: discord.Message):
+    return list(bot.prefixes)
 
 
 class CustomBot(commands.AutoShardedBot):
-    def __init__(self, command_prefix: typing.Union[str, typing.Callable[[discord.Message], typing.Awaitable]] = None, **options):
+    def __init__(self, command_prefix: typing.Union[str, typing.Callable[[discord.Message], typing.Awaitable]] = None, config: Config = None, **options):
+        # With our own prefixes, messages that can't be commands are dropped before building a context
+        self.fast_prefix_check = not command_prefix
         if not command_prefix:
             command_prefix = get_prefix
 
         super().__init__(command_prefix, **options)
-        self.config = Config()
-        self.logger = FakeLogger()
-        self.db = Storage(self)
+        self.config = config or Config()
+        self._prefixes: typing.Optional[typing.Tuple[str, ...]] = None
+        self.logger = FakeLogger(level=self.config.log_level, json_path=self.config.log_json_path)
+        self.db = get_storage(self)
         self.commands_used = collections.Counter()
+        self.output = Output(self.config)
 
         with open("credentials.json", "r") as f:
             credentials = json.load(f)
 
         self.token = credentials["discord_token"]
         self.uptime = datetime.datetime.utcnow()
-        self.loop.set_debug(True)
+        self.loop_monitor = LoopMonitor(self.loop, threshold=self.config.loop_monitor_threshold, lag_interval=self.config.loop_lag_interval,
+                                        history=self.config.loop_monitor_history)
+
+        self.session: typing.Optional[aiohttp.ClientSession] = None
+        self.metrics_server: typing.Optional[metrics.MetricsServer] = None
+
+    def make_session(self) -> aiohttp.ClientSession:
+        """
+        The HTTP client used by every cog. Connections (and TLS sessions) are pooled and kept alive per host,
+        and DNS results are cached.
+        """
+        connector = aiohttp.TCPConnector(limit=self.config.http_limit,
+                                         limit_per_host=self.config.http_limit_per_host,
+                                         ttl_dns_cache=self.config.http_dns_cache_ttl,
+                                         use_dns_cache=True)
+        return aiohttp.ClientSession(connector=connector, timeout=aiohttp.ClientTimeout(total=self.config.http_timeout))
+
+    async def start(self, *args, **kwargs):
+        if self.session is None:
+            self.session = self.make_session()
+
+        if self.config.metrics_enabled and self.metrics_server is None:
+            metrics_server = metrics.MetricsServer(self.config.metrics_host, self.config.metrics_port)
+            try:
+                await metrics_server.start()
+            except OSError:
+                # The port is taken, e.g. by another instance: better run without metrics than not at all
+                self.logger.exception(f"Couldn't serve the metrics on {self.config.metrics_host}:{self.config.metrics_port}, running without them.")
+                await metrics_server.stop()
+            else:
+                self.metrics_server = metrics_server
+
+        if self.config.loop_monitor_enabled:
+            self.loop_monitor.start()
+
+        await super().start(*args, **kwargs)
+
+    async def close(self):
+        # Cogs keeping state in memory write it to disk before we exit, while they are still loaded: closing unloads them
+        for cog in list(self.cogs.values()):
+            flush = getattr(cog, "flush", None)
+            if flush is not None:
+                try:
+                    await flush()
+                except Exception:
+                    self.logger.exception(f"Couldn't flush {type(cog).__name__} before closing.")
+
+        await super().close()
+        await self.db.close()
+        await self.close_session()
+
+        self.loop_monitor.stop()
+        if self.metrics_server is not None:
+            await self.metrics_server.stop()
+
+    async def invoke(self, ctx):
+        if ctx.command is None:
+            return await super().invoke(ctx)
+
+        start = time.perf_counter()
+        try:
+            await super().invoke(ctx)
+        finally:
+            status = "error" if ctx.command_failed else "ok"
+            metrics.COMMANDS_LATENCY.observe(time.perf_counter() - start, command=ctx.command.qualified_name, status=status)
+
+    async def close_session(self):
+        if self.session is not None and not self.session.closed:
+            await self.session.close()
+
+    @property
+    def prefixes(self) -> typing.Tuple[str, ...]:
+        # The mentions need our user ID, only known once logged in
+        if self._prefixes is None:
+            if self.user is None:
+                return PREFIXES
+            self._prefixes = compile_prefixes(self.user.id)
+        return self._prefixes
 
     async def on_message(self, message):
         if message.author.bot:
             return  # ignore messages from other bots
 
+        if self.fast_prefix_check and not message.content.startswith(self.prefixes):
+            return  # not a command, the vast majority of messages
+
         ctx = await self.get_context(message, cls=context.CustomContext)
         if ctx.prefix is not None:
             await self.invoke(ctx)
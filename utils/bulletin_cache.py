@@ -0,0 +1,72 @@
+import concurrent.futures
+import json
+import os
+import typing
+
+
+class BulletinCache:
+    """
+    Raw SIFI replies kept on disk, one JSON file per member, so that a restart doesn't empty the bulletins cache.
+
+    Nothing is read at startup: the directory is listed on the first lookup, and a member's file is only read
+    the first time their bulletin is requested. File I/O runs on a single worker thread, off the event loop.
+    """
+    def __init__(self, bot, path: str):
+        self.bot = bot
+        self.path = path
+        self._stored_ids: typing.Optional[typing.Set[int]] = None
+        self._executor = concurrent.futures.ThreadPoolExecutor(max_workers=1)
+
+    def _file_path(self, member_id: int) -> str:
+        return os.path.join(self.path, f"{member_id}.json")
+
+    def _list_sync(self) -> typing.Set[int]:
+        os.makedirs(self.path, exist_ok=True)
+        return {int(name[:-5]) for name in os.listdir(self.path) if name.endswith(".json") and name[:-5].isdigit()}
+
+    def _read_sync(self, member_id: int) -> typing.Tuple[int, dict]:
+        with open(self._file_path(member_id), "r") as f:
+            entry = json.load(f)
+        return int(entry["creation"]), entry["payload"]
+
+    def _write_sync(self, member_id: int, creation: int, payload: dict):
+        file_path = self._file_path(member_id)
+        with open(file_path + ".tmp", "w") as f:
+            json.dump({"creation": creation, "payload": payload}, f)
+        os.replace(file_path + ".tmp", file_path)
+
+    def _remove_sync(self, member_id: int):
+        try:
+            os.remove(self._file_path(member_id))
+        except FileNotFoundError:
+            pass
+
+    async def _run(self, func, *args):
+        return await self.bot.loop.run_in_executor(self._executor, func, *args)
+
+    async def _ensure_listed(self):
+        if self._stored_ids is None:
+            self._stored_ids = await self._run(self._list_sync)
+            self.bot.logger.debug(f"[bulletin_cache] {len(self._stored_ids)} bulletins available on disk.")
+
+    async def get(self, member_id: int) -> typing.Tuple[typing.Optional[int], typing.Optional[dict]]:
+        await self._ensure_listed()
+        if member_id not in self._stored_ids:
+            return None, None
+
+        try:
+            return await self._run(self._read_sync, member_id)
+        except (OSError, ValueError, KeyError):
+            self.bot.logger.exception(f"[bulletin_cache] Unreadable bulletin for {member_id}, dropping it.")
+            await self.remove(member_id)
+            return None, None
+
+    async def put(self, member_id: int, creation: int, payload: dict):
+        await self._ensure_listed()
+        await self._run(self._write_sync, member_id, creation, payload)
+        self._stored_ids.add(member_id)
+
+    async def remove(self, member_id: int):
+        await self._ensure_listed()
+        self._stored_ids.discard(member_id)
+        await self._run(self._remove_sync, member_id)
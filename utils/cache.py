@@ -0,0 +1,77 @@
+import collections
+import time
+import typing
+
+MISSING = object()
+
+
+class TTLCache:
+    """
+    Dictionary whose entries expire after some time, and that forgets the least recently used ones past maxsize.
+
+    Expiry uses the wall clock, so entries can be saved and loaded back after a restart.
+    """
+    def __init__(self, ttl: float, maxsize: typing.Optional[int] = None):
+        self.ttl = ttl
+        self.maxsize = maxsize
+        self.hits = 0
+        self.misses = 0
+        self._data: typing.Dict[typing.Hashable, typing.Tuple[float, typing.Any]] = collections.OrderedDict()
+
+    def __len__(self):
+        return len(self._data)
+
+    def __contains__(self, key: typing.Hashable):
+        # Unlike get, doesn't count as a use of the entry
+        entry = self._data.get(key)
+        return entry is not None and entry[0] > time.time()
+
+    def get(self, key: typing.Hashable, default=MISSING):
+        """
+        Return the value for key, or default (MISSING unless specified) if it isn't cached or has expired.
+        """
+        entry = self._data.get(key)
+        if entry is not None:
+            expires, value = entry
+            if expires > time.time():
+                self._data.move_to_end(key)
+                self.hits += 1
+                return value
+            del self._data[key]
+
+        self.misses += 1
+        return default
+
+    def set(self, key: typing.Hashable, value, ttl: typing.Optional[float] = None, expires: typing.Optional[float] = None):
+        if expires is None:
+            expires = time.time() + (self.ttl if ttl is None else ttl)
+
+        self._data[key] = (expires, value)
+        self._data.move_to_end(key)
+
+        if self.maxsize is not None:
+            while len(self._data) > self.maxsize:
+                self._data.popitem(last=False)
+
+    def pop(self, key: typing.Hashable):
+        self._data.pop(key, None)
+
+    def clear(self):
+        self._data.clear()
+
+    def expire(self):
+        now = time.time()
+        for key in [key for key, (expires, value) in self._data.items() if expires <= now]:
+            del self._data[key]
+
+    def items(self) -> typing.List[typing.Tuple[typing.Hashable, float, typing.Any]]:
+        """
+        Every entry that hasn't expired, as (key, expiry timestamp, value), from the least to the most recently used.
+        """
+        now = time.time()
+        return [(key, expires, value) for key, (expires, value) in self._data.items() if expires > now]
+
+    @property
+    def hit_ratio(self) -> float:
+        total = self.hits + self.misses
+        return self.hits / total if total else 0.0
@@ -1,2 +1,110 @@
 class Config:
-    pass
+    # Logging
+    log_level = "DEBUG"
+    log_json_path = None  # also write the logs as JSON lines to this file, e.g. "all.jsonl"
+
+    # Profiles storage
+    storage_backend = "json"  # "json" or "sqlite"
+
+    profiles_path = "profiles.json"
+    profiles_journal_path = "profiles.journal"
+    profiles_compaction_interval = 60 * 10  # seconds between two background compactions
+    profiles_compaction_records = 500  # compact earlier if the journal grows past this many records
+
+    sqlite_path = "profiles.sqlite3"  # created from the JSON profiles on first use
+    sqlite_batch_delay = 0.05  # seconds to wait for more writes before committing a batch
+
+    # HTTP client shared by the cogs
+    http_limit = 100  # simultaneous connections, all hosts included
+    http_limit_per_host = 10  # simultaneous connections to a single host, kept alive between requests
+    http_dns_cache_ttl = 60 * 5  # seconds
+    http_timeout = 60 * 5  # seconds, for a whole request
+
+    # Replies, split in messages of at most 2000 characters (see utils/output.py)
+    output_rate = 5  # messages of split replies sent to a channel...
+    output_per = 5  # ...every this many seconds, as Discord allows
+    output_max_messages = 5  # longer replies are sent as a message.txt file instead
+    output_max_queues = 1000  # idle channel queues are forgotten past this many
+
+    # Metrics, served in the Prometheus text format on http://metrics_host:metrics_port/metrics
+    metrics_enabled = True
+    metrics_host = "127.0.0.1"
+    metrics_port = 9101
+
+    # Event loop monitor (see utils/loop_monitor.py), can be toggled at runtime with the loop command
+    loop_monitor_enabled = True
+    loop_monitor_threshold = 0.1  # seconds, callbacks blocking the loop longer than that are recorded with their stack
+    loop_lag_interval = 1  # seconds between two measures of the event loop lag
+    loop_monitor_history = 50  # slow callbacks kept for the report
+
+    # Trombi
+    trombi_search_url = "https://trombi.minet.net/api/v1/people/search"
+    trombi_cache_ttl = 60 * 60  # seconds a page of search results is reused
+    trombi_cache_size = 1000  # pages of search results kept, the least recently used are forgotten first
+    trombi_search_page_size = 20  # people per page of search results, a shorter page is the last one
+    trombi_prefetch_pages = 2  # pages after the one requested that are fetched in the background, only the next one when their number is unknown
+
+    # Local copy of the trombi directory, searches are answered from it once downloaded (see utils/people_directory.py)
+    trombi_people_url = "https://trombi.minet.net/api/v1/people"  # listing of every person, paginated like the search replies
+    trombi_people_since_param = "updated_since"  # listing parameter to only get people changed since a timestamp, None if unsupported
+    trombi_index_path = "cache/trombi_people.json"
+    trombi_index_staleness = 60 * 60 * 6  # seconds, an older copy is resynced (only the changes when possible)
+    trombi_index_full_sync_interval = 60 * 60 * 24 * 7  # seconds between two downloads of the whole directory, forgetting people who left
+    trombi_index_max_age = 60 * 60 * 24 * 3  # seconds, if syncs keep failing past that, searches go to the API again
+    trombi_sync_concurrency = 4  # pages of the listing downloaded at once
+    trombi_page_size = 20  # people per page of results answered from the local copy
+
+    # Trombi photos, downloaded by the bot and attached to the replies (see utils/photo_cache.py)
+    trombi_photo_url = "https://trombi.imtbs-tsp.eu/photo.php"  # ?uid=jovart_a&w=240&h=320
+    trombi_photo_size = (240, 320)  # width, height
+    photos_cache_path = "cache/photos"
+    photos_cache_max_bytes = 100 * 1024 * 1024  # the least recently used photos are removed past this size
+    photos_max_age = 60 * 60 * 24 * 7  # seconds a photo is used before asking the server whether it changed
+    photos_cache_save_delay = 30  # seconds, changes to the index are written to disk together
+
+    # LDAP
+    ldap_server = "127.0.0.1"
+    ldap_base_dn = "ou=People,dc=int-evry,dc=fr"
+    ldap_pool_size = 4  # connections, and at most as many searches running at once
+    ldap_timeout = 10  # seconds
+    ldap_batch_size = 50  # logins looked up by a single search when syncing a whole guild
+    ldap_cache_path = "cache/ldap.json"
+    ldap_cache_ttl = 60 * 60 * 24 * 30  # seconds, people rarely change group during a school year
+    ldap_negative_cache_ttl = 60 * 60  # seconds, for logins that weren't found
+    ldap_cache_save_delay = 30  # seconds, changes to the cache are written to disk together
+
+    # BigBlueButton slides export (see utils/bbb.py)
+    bbb_download_concurrency = 8  # slide images downloaded at once for an export
+    bbb_pdf_workers = 2  # processes assembling PDFs
+    bbb_max_slides = 500
+    bbb_progress_interval = 3  # seconds between two edits of the progress message
+    bbb_export_workers = 2  # exports running at once, the others wait in a queue
+    bbb_cache_path = "cache/bbb"  # exported PDFs, one per recording
+    bbb_cache_max_bytes = 500 * 1024 * 1024  # the least recently used PDFs are removed past this size
+
+    # Roles
+    roles_workers = 3  # members updated in parallel by profile get_roles
+    roles_progress_interval = 5  # seconds between two edits of the progress message
+
+    # Notes
+    sifi_url = "https://notes.api-d.com/sifiQuery.php"
+    sifi_slots = 6  # simultaneous requests to SIFI
+    sifi_bulk_slots = 4  # of which preemptive caching can use at most this many, the rest is kept for commands
+    sifi_retries = 3  # retries of a failed request before giving up
+    sifi_backoff = 5  # seconds before the first retry, doubled for every following one
+    sifi_interactive_retries = 1  # the same, for commands someone is waiting for
+    sifi_interactive_backoff = 1
+    bulletins_cache_path = "cache/bulletins"  # raw SIFI replies, one file per member, kept across restarts
+    bulletins_max_age = 60 * 60 * 4  # seconds a downloaded bulletin is considered up to date
+    bulletins_stale_grace = 60 * 60 * 24  # seconds after that during which commands reply with it while it's refreshed in the background
+
+    # Watched accounts polling (see utils/polling.py)
+    notes_poll_interval = 60 * 10  # seconds, normal interval between two polls of an account
+    notes_poll_fast_interval = 60 * 2  # seconds, right after a change or during an exam window
+    notes_poll_quiet_interval = 60 * 30  # seconds, during the quiet hours
+    notes_poll_max_interval = 60 * 60  # seconds, upper bound of the backoff
+    notes_poll_jitter = 0.1  # intervals are randomly spread by this fraction
+    notes_poll_recent_change = 60 * 60 * 2  # seconds during which an account is polled fast after a change
+    notes_poll_slow_response = 30  # seconds, a poll taking longer than that counts as SIFI being overloaded
+    notes_poll_quiet_hours = (0, 7)  # local hours [start, end) during which grades are never released
+    notes_poll_exam_windows = []  # [("2021-01-18", "2021-02-05"), ...], inclusive dates when grades are expected
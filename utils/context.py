@@ -1,3 +1,4 @@
+import functools
 import io
 import logging
 import typing
@@ -5,6 +6,7 @@ import typing
 import discord
 from discord import Message
 
+from utils import output
 from utils.logger import LoggerConstant
 from discord.ext import commands
 from discord.errors import InvalidArgument
@@ -29,12 +31,15 @@ class CustomContext(commands.Context):
         await self.send(message, **kwargs)
 
     async def send(self, content=None, *, file=None, files=None, **kwargs) -> Message:
+        content = str(content) if content is not None else None
+        pages = output.paginate(content) if content else []
+
         # Case for a too-big message
-        if content and len(content) > 1990:
+        if len(pages) > self.bot.config.output_max_messages:
             self.logger.warning("Message content is too big to be sent, putting in a text file for sending.")
 
             message_file = discord.File(io.BytesIO(content.encode()), filename="message.txt")
-            content = None
+            pages = []
 
             if file is not None and files is not None:
                 raise InvalidArgument('Cannot pass both file and files parameter to send()')
@@ -49,6 +54,7 @@ class CustomContext(commands.Context):
             else:
                 file = message_file
 
-        message = await super().send(content, file=file, files=files, **kwargs)
+        # Through the channel queue, so that the pages aren't mixed with other replies, nor rate limited
+        messages = await self.bot.output.send(self.channel.id, functools.partial(commands.Context.send, self), pages, file=file, files=files, **kwargs)
 
-        return message
+        return messages[-1]
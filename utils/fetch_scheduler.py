@@ -0,0 +1,158 @@
+import asyncio
+import heapq
+import itertools
+import random
+import time
+import typing
+
+from utils import metrics
+
+# Priority classes, the lower the sooner
+INTERACTIVE = 0  # someone is waiting for the reply of a command
+WATCHER = 1  # polls of the watched accounts
+BULK = 2  # preemptive caching of many bulletins
+
+PRIORITY_NAMES = {INTERACTIVE: "interactive", WATCHER: "watcher", BULK: "bulk"}
+
+
+class FetchRequest:
+    """
+    One fetch going through the scheduler. Its priority can be raised while it waits, when someone more urgent needs the same result.
+    """
+    __slots__ = ("priority", "slot_priority", "sequence", "future", "enqueued_at")
+
+    def __init__(self, priority: int):
+        self.priority = priority
+        self.slot_priority = priority  # the class whose slot the request holds, it may have been promoted since
+        self.sequence = 0
+        self.future: typing.Optional[asyncio.Future] = None
+        self.enqueued_at = 0.0
+
+    @property
+    def waiting(self) -> bool:
+        return self.future is not None and not self.future.done()
+
+
+class ClassStats:
+    __slots__ = ("waits", "wait_total", "wait_max", "retries", "failures")
+
+    def __init__(self):
+        self.waits = 0
+        self.wait_total = 0.0
+        self.wait_max = 0.0
+        self.retries = 0
+        self.failures = 0
+
+
+class FetchScheduler:
+    """
+    Shares a fixed number of slots between fetches, always handing a free slot to the most urgent waiting request.
+
+    Each priority class can be limited to fewer slots than the total, so that bulk work always leaves room for interactive commands.
+    The limits must not grow as the priority decreases. Retries back off without holding a slot, and each class can have its
+    own (retries, backoff) policy, so that someone waiting for a command doesn't wait for the patient background retries.
+    """
+    def __init__(self, loop: asyncio.AbstractEventLoop, slots: int, class_limits: typing.Optional[typing.Dict[int, int]] = None,
+                 retries: int = 3, backoff: float = 5, class_retries: typing.Optional[typing.Dict[int, typing.Tuple[int, float]]] = None):
+        self.loop = loop
+        self.slots = slots
+        self.class_limits = {priority: slots for priority in PRIORITY_NAMES}
+        self.class_limits.update(class_limits or {})
+        self.retry_policies = {priority: (retries, backoff) for priority in PRIORITY_NAMES}
+        self.retry_policies.update(class_retries or {})
+
+        self.active = 0
+        self.active_by_class = {priority: 0 for priority in PRIORITY_NAMES}
+        self.stats = {priority: ClassStats() for priority in PRIORITY_NAMES}
+        self._waiting: typing.List[typing.Tuple[int, int, FetchRequest]] = []
+        self._sequence = itertools.count()
+
+    def _can_start(self, priority: int) -> bool:
+        return self.active < self.slots and self.active_by_class[priority] < self.class_limits[priority]
+
+    def _start(self, request: FetchRequest):
+        request.slot_priority = request.priority
+        self.active += 1
+        self.active_by_class[request.priority] += 1
+
+        waited = time.perf_counter() - request.enqueued_at
+        stats = self.stats[request.priority]
+        stats.waits += 1
+        stats.wait_total += waited
+        stats.wait_max = max(stats.wait_max, waited)
+        metrics.QUEUE_WAIT.observe(waited, queue=f"sifi_{PRIORITY_NAMES[request.priority]}")
+
+    def _wake(self):
+        while self._waiting:
+            priority, _, request = self._waiting[0]
+            if not request.waiting:
+                # Cancelled while waiting
+                heapq.heappop(self._waiting)
+                continue
+            if not self._can_start(priority):
+                # Limits don't grow with the priority, so nothing further down the queue can start either
+                return
+            heapq.heappop(self._waiting)
+            self._start(request)
+            request.future.set_result(None)
+
+    def promote(self, request: FetchRequest, priority: int):
+        if priority >= request.priority:
+            return
+
+        request.priority = priority
+        if request.waiting:
+            self._waiting = [(r.priority, sequence, r) for _, sequence, r in self._waiting]
+            heapq.heapify(self._waiting)
+            self._wake()
+
+    async def acquire(self, request: FetchRequest):
+        request.enqueued_at = time.perf_counter()
+        request.sequence = next(self._sequence)
+        request.future = self.loop.create_future()
+        heapq.heappush(self._waiting, (request.priority, request.sequence, request))
+        self._wake()
+
+        try:
+            await request.future
+        except asyncio.CancelledError:
+            if request.future.done() and not request.future.cancelled():
+                # We got the slot right as we were cancelled
+                self.release(request)
+            else:
+                request.future.cancel()
+            raise
+
+    def release(self, request: FetchRequest):
+        self.active -= 1
+        self.active_by_class[request.slot_priority] -= 1
+        self._wake()
+
+    async def run(self, request: FetchRequest, fetch: typing.Callable[[], typing.Awaitable], retry_on: typing.Tuple[typing.Type[BaseException], ...] = ()):
+        """
+        Run fetch() in a slot, retrying on the given exceptions with an exponential backoff, as the retry policy of the
+        request's class allows. A request promoted while it retries gets the policy of its new class.
+        """
+        attempt = 0
+        while True:
+            await self.acquire(request)
+            try:
+                return await fetch()
+            except retry_on:
+                retries, backoff = self.retry_policies[request.priority]
+                if attempt >= retries:
+                    self.stats[request.priority].failures += 1
+                    raise
+            finally:
+                self.release(request)
+
+            attempt += 1
+            self.stats[request.priority].retries += 1
+            await asyncio.sleep(backoff * (2 ** (attempt - 1)) * random.uniform(1, 1.5))
+
+    def queue_depths(self) -> typing.Dict[int, int]:
+        depths = {priority: 0 for priority in PRIORITY_NAMES}
+        for priority, _, request in self._waiting:
+            if request.waiting:
+                depths[priority] += 1
+        return depths
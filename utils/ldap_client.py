@@ -0,0 +1,244 @@
+import asyncio
+import concurrent.futures
+import json
+import os
+import queue
+import time
+import typing
+
+import ldap3
+from ldap3.core.exceptions import LDAPException
+from ldap3.utils.conv import escape_filter_chars
+
+from utils import metrics
+from utils.cache import MISSING, TTLCache
+
+# Only what we actually read from the entries
+LDAP_ATTRIBUTES = ["mail", "givenName", "sn", "uid", "title"]
+
+
+def entry_to_login_info(entry) -> dict:
+    return {"mail": str(entry["mail"]), "display_name": str(entry["givenName"]) + " " + str(entry["sn"]), "first_name": str(entry["givenName"]), "last_name": str(entry["sn"]),
+            "uid": str(entry["uid"]), "title": str(entry["title"])}
+
+
+class LDAPClient:
+    """
+    Asynchronous access to the school LDAP.
+
+    ldap3 is synchronous, so searches run on a pool of worker threads, each borrowing an already bound connection
+    from a shared pool instead of binding a new one. A semaphore bounds the number of searches waiting for a thread.
+    """
+    def __init__(self, bot):
+        self.bot = bot
+        self.config = bot.config
+        self.server = ldap3.Server(self.config.ldap_server, use_ssl=False, connect_timeout=self.config.ldap_timeout)
+
+        self._connections = queue.LifoQueue()
+        self._executor = concurrent.futures.ThreadPoolExecutor(max_workers=self.config.ldap_pool_size)
+        self._semaphore = asyncio.Semaphore(self.config.ldap_pool_size)
+
+        self.cache = TTLCache(self.config.ldap_cache_ttl)
+        self.negative_cache = TTLCache(self.config.ldap_negative_cache_ttl)
+        self._cache_dirty = False
+        self._save_task: typing.Optional[asyncio.Task] = None
+        self._load_cache()
+
+    def _load_cache(self):
+        try:
+            with open(self.config.ldap_cache_path, "r") as f:
+                saved = json.load(f)
+        except FileNotFoundError:
+            return
+        except ValueError:
+            self.bot.logger.exception(f"Unreadable LDAP cache at {self.config.ldap_cache_path}, starting from scratch.")
+            return
+
+        for key, expires, info in saved["positive"]:
+            self.cache.set(key, info, expires=expires)
+        for key, expires in saved["negative"]:
+            self.negative_cache.set(key, True, expires=expires)
+
+        self.cache.expire()
+        self.negative_cache.expire()
+        self.bot.logger.info(f"Loaded {len(self.cache)} LDAP cache entries ({len(self.negative_cache)} negative).")
+
+    def _write_cache_sync(self, saved: dict):
+        path = self.config.ldap_cache_path
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        with open(path + ".tmp", "w") as f:
+            json.dump(saved, f)
+        os.replace(path + ".tmp", path)
+
+    def _mark_cache_dirty(self):
+        self._cache_dirty = True
+        if self._save_task is None:
+            self._save_task = self.bot.loop.create_task(self._save_cache_later())
+
+    async def _save_cache_later(self):
+        try:
+            while self._cache_dirty:
+                await asyncio.sleep(self.config.ldap_cache_save_delay)
+                await self.save_cache()
+        finally:
+            self._save_task = None
+
+    async def save_cache(self):
+        self._cache_dirty = False
+        saved = {"positive": [[key, expires, info] for key, expires, info in self.cache.items()],
+                 "negative": [[key, expires] for key, expires, _ in self.negative_cache.items()]}
+        await self.bot.loop.run_in_executor(None, self._write_cache_sync, saved)
+
+    def _remember(self, term: str, info: typing.Optional[dict]):
+        if info:
+            self.cache.set(info["uid"].lower(), info)
+            self.cache.set(info["mail"].lower(), info)
+            self.negative_cache.pop(term)
+        else:
+            self.negative_cache.set(term, True)
+        self._mark_cache_dirty()
+
+    def _lookup_cache(self, term: str):
+        """
+        The cached info, None if the login is known not to exist, or MISSING if we have to ask the LDAP.
+        """
+        info = self.cache.get(term)
+        if info is not MISSING:
+            return info
+        if self.negative_cache.get(term) is not MISSING:
+            return None
+        return MISSING
+
+    def invalidate(self, email_or_login: typing.Optional[str] = None):
+        """
+        Forget one login (along with the other key of the same person), or everything if None.
+        """
+        if email_or_login is None:
+            self.cache.clear()
+            self.negative_cache.clear()
+        else:
+            term = email_or_login.lower()
+            info = self.cache.get(term, None)
+            if info:
+                self.cache.pop(info["uid"].lower())
+                self.cache.pop(info["mail"].lower())
+            self.cache.pop(term)
+            self.negative_cache.pop(term)
+        self._mark_cache_dirty()
+
+    def cache_stats(self) -> dict:
+        return {"entries": len(self.cache), "negative_entries": len(self.negative_cache),
+                "hits": self.cache.hits, "negative_hits": self.negative_cache.hits,
+                # Every lookup missing the negative cache went to the LDAP
+                "misses": self.negative_cache.misses}
+
+    def _connect_sync(self) -> ldap3.Connection:
+        return ldap3.Connection(self.server, auto_bind=True, receive_timeout=self.config.ldap_timeout)
+
+    def _search_sync(self, search_filter: str) -> list:
+        try:
+            conn = self._connections.get_nowait()
+        except queue.Empty:
+            conn = self._connect_sync()
+
+        try:
+            conn.search(self.config.ldap_base_dn, search_filter, ldap3.SUBTREE, attributes=LDAP_ATTRIBUTES)
+        except LDAPException:
+            # The server probably dropped this connection, try again once with a fresh one
+            conn.unbind()
+            conn = self._connect_sync()
+            conn.search(self.config.ldap_base_dn, search_filter, ldap3.SUBTREE, attributes=LDAP_ATTRIBUTES)
+
+        entries = list(conn.entries)
+        self._connections.put(conn)
+        return entries
+
+    def _close_sync(self):
+        while True:
+            try:
+                conn = self._connections.get_nowait()
+            except queue.Empty:
+                return
+            conn.unbind()
+
+    async def search(self, search_filter: str) -> list:
+        start = time.perf_counter()
+        async with self._semaphore:
+            metrics.QUEUE_WAIT.observe(time.perf_counter() - start, queue="ldap")
+            try:
+                with metrics.UPSTREAM_LATENCY.time(service="ldap"):
+                    return await self.bot.loop.run_in_executor(self._executor, self._search_sync, search_filter)
+            except Exception:
+                metrics.UPSTREAM_ERRORS.inc(service="ldap")
+                raise
+
+    async def get_login_info(self, email_or_login: str) -> typing.Optional[dict]:
+        term = email_or_login.lower()
+        cached = self._lookup_cache(term)
+        if cached is not MISSING:
+            return cached
+
+        if "@" in email_or_login:
+            search_filter = u"(mail={})".format(escape_filter_chars(email_or_login))
+        else:
+            search_filter = u"(uid={})".format(escape_filter_chars(email_or_login))
+
+        entries = await self.search(search_filter)
+        try:
+            res = entries[0]
+        except IndexError:
+            self._remember(term, None)
+            return None
+
+        info = entry_to_login_info(res)
+        self._remember(term, info)
+        return info
+
+    async def get_logins_info(self, emails_or_logins: typing.Iterable[str]) -> typing.Dict[str, dict]:
+        """
+        Look many users up at once, with one OR search for every ldap_batch_size of them.
+
+        The result maps every login or email that was found, lowercased, to its login info.
+        """
+        infos = {}
+        terms = []
+        for term in sorted({term.lower() for term in emails_or_logins}):
+            cached = self._lookup_cache(term)
+            if cached is MISSING:
+                terms.append(term)
+            elif cached:
+                infos[term] = cached
+
+        batch_size = self.config.ldap_batch_size
+        filters = []
+
+        for i in range(0, len(terms), batch_size):
+            clauses = []
+            for term in terms[i:i + batch_size]:
+                attribute = "mail" if "@" in term else "uid"
+                clauses.append(u"({}={})".format(attribute, escape_filter_chars(term)))
+            filters.append(u"(|{})".format("".join(clauses)))
+
+        results = await asyncio.gather(*[self.search(search_filter) for search_filter in filters])
+
+        found = {}
+        for entries in results:
+            for entry in entries:
+                info = entry_to_login_info(entry)
+                found[info["uid"].lower()] = info
+                found[info["mail"].lower()] = info
+
+        for term in terms:
+            info = found.get(term)
+            self._remember(term, info)
+            if info:
+                infos[term] = info
+
+        return infos
+
+    async def close(self):
+        if self._save_task is not None:
+            self._save_task.cancel()
+        await self.save_cache()
+        await self.bot.loop.run_in_executor(self._executor, self._close_sync)
+        self._executor.shutdown(wait=False)
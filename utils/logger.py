@@ -1,14 +1,48 @@
+import atexit
+import copy
+import json
 import logging
+import logging.handlers
+import queue
 import typing
 
 import discord
 
 
-def init_logger() -> typing.Tuple[logging.Logger]:
+class JsonLinesFormatter(logging.Formatter):
+    """
+    One JSON object per line, easier to process than the text logs.
+    """
+    def format(self, record: logging.LogRecord) -> str:
+        entry = {"time": record.created, "logger": record.name, "level": record.levelname, "message": record.getMessage()}
+        if record.exc_info:
+            entry["exception"] = self.formatException(record.exc_info)
+        elif record.exc_text:
+            entry["exception"] = record.exc_text
+        return json.dumps(entry, ensure_ascii=False)
+
+
+class LocalQueueHandler(logging.handlers.QueueHandler):
+    """
+    QueueHandler for a listener in the same process. The stdlib one formats the record before queuing it, which puts
+    the traceback in the message and formats it on the event loop. Here, only the message is merged with its
+    arguments: the exception is kept as is, and formatted by each handler on the listener thread.
+    """
+    def prepare(self, record: logging.LogRecord) -> logging.LogRecord:
+        record = copy.copy(record)
+        record.msg = record.getMessage()
+        record.args = None
+        return record
+
+
+def init_logger(level: typing.Union[int, str] = logging.DEBUG, json_path: typing.Optional[str] = None) -> logging.Logger:
     # Create the logger
+    # The handlers below do file and console I/O: they don't get the records directly but through a queue, that a
+    # listener thread empties. Logging from the event loop then only costs putting the record in the queue.
 
     base_logger = logging.getLogger("matchmaking")
-    base_logger.setLevel(logging.DEBUG)
+    base_logger.setLevel(level)
+    base_handlers = []
 
     formatter = logging.Formatter('%(asctime)s :: %(levelname)s :: %(message)s')
 
@@ -18,12 +52,18 @@ def init_logger() -> typing.Tuple[logging.Logger]:
     file_handler = RotatingFileHandler('all.log', 'a', 10000000, 1)
     file_handler.setFormatter(formatter)
     file_handler.setLevel(logging.DEBUG)
-    base_logger.addHandler(file_handler)
+    base_handlers.append(file_handler)
 
     file_handler = RotatingFileHandler('errors.log', 'a', 10000000, 1)
     file_handler.setFormatter(formatter)
     file_handler.setLevel(logging.WARNING)
-    base_logger.addHandler(file_handler)
+    base_handlers.append(file_handler)
+
+    if json_path:
+        json_handler = RotatingFileHandler(json_path, 'a', 10000000, 1)
+        json_handler.setFormatter(JsonLinesFormatter())
+        json_handler.setLevel(logging.DEBUG)
+        base_handlers.append(json_handler)
 
     # And to console
 
@@ -144,7 +184,7 @@ def init_logger() -> typing.Tuple[logging.Logger]:
     steam_handler.setLevel(logging.DEBUG)
 
     steam_handler.setFormatter(formatter)
-    base_logger.addHandler(steam_handler)
+    base_handlers.append(steam_handler)
 
     discord_logger = logging.getLogger('discord')
     discord_logger.setLevel(logging.WARNING)
@@ -154,15 +194,29 @@ def init_logger() -> typing.Tuple[logging.Logger]:
     discord_steam_handler = ColorStreamHandler()
     discord_steam_handler.setLevel(logging.INFO)
     discord_steam_handler.setFormatter(discord_formatter)
-    discord_logger.addHandler(discord_steam_handler)
+
+    base_logger.addHandler(start_queue_listener(base_handlers))
+    discord_logger.addHandler(start_queue_listener([discord_steam_handler]))
 
     return base_logger
 
 
+def start_queue_listener(handlers: typing.List[logging.Handler]) -> logging.handlers.QueueHandler:
+    """
+    Run the handlers on a background thread, and return the handler feeding them.
+    """
+    records = queue.Queue(-1)
+    listener = logging.handlers.QueueListener(records, *handlers, respect_handler_level=True)
+    listener.start()
+    # Stopping the listener emits whatever is still in the queue
+    atexit.register(listener.stop)
+    return LocalQueueHandler(records)
+
+
 class FakeLogger:
-    def __init__(self, logger: logging.Logger = None):
+    def __init__(self, logger: logging.Logger = None, level: typing.Union[int, str] = logging.DEBUG, json_path: typing.Optional[str] = None):
         if not logger:
-            logger = init_logger()
+            logger = init_logger(level, json_path)
         self.logger = logger
 
     def make_message_prefix(self, guild: typing.Optional[discord.Guild] = None, channel: typing.Optional[discord.ChannelType] = None, member: typing.Optional[discord.Member] = None):
@@ -181,23 +235,29 @@ class FakeLogger:
         else:
             return f""
 
+    def log(self, level: int, message: str, guild: typing.Optional[discord.Guild] = None, channel: typing.Optional[discord.ChannelType] = None, member: typing.Optional[discord.Member] = None,
+            exc_info: bool = False):
+        # Don't bother building the message if it's going to be filtered out
+        if self.logger.isEnabledFor(level):
+            self.logger.log(level, self.make_message_prefix(guild, channel, member) + str(message), exc_info=exc_info)
+
     def debug(self, message: str, guild: typing.Optional[discord.Guild] = None, channel: typing.Optional[discord.ChannelType] = None, member: typing.Optional[discord.Member] = None):
-        return self.logger.debug(self.make_message_prefix(guild, channel, member) + str(message))
+        return self.log(logging.DEBUG, message, guild, channel, member)
 
     def info(self, message: str, guild: typing.Optional[discord.Guild] = None, channel: typing.Optional[discord.ChannelType] = None, member: typing.Optional[discord.Member] = None):
-        return self.logger.info(self.make_message_prefix(guild, channel, member) + str(message))
+        return self.log(logging.INFO, message, guild, channel, member)
 
     def warn(self, message: str, guild: typing.Optional[discord.Guild] = None, channel: typing.Optional[discord.ChannelType] = None, member: typing.Optional[discord.Member] = None):
-        return self.logger.warn(self.make_message_prefix(guild, channel, member) + str(message))
+        return self.log(logging.WARNING, message, guild, channel, member)
 
     def warning(self, message: str, guild: typing.Optional[discord.Guild] = None, channel: typing.Optional[discord.ChannelType] = None, member: typing.Optional[discord.Member] = None):
-        return self.logger.warning(self.make_message_prefix(guild, channel, member) + str(message))
+        return self.log(logging.WARNING, message, guild, channel, member)
 
     def error(self, message: str, guild: typing.Optional[discord.Guild] = None, channel: typing.Optional[discord.ChannelType] = None, member: typing.Optional[discord.Member] = None):
-        return self.logger.error(self.make_message_prefix(guild, channel, member) + str(message))
+        return self.log(logging.ERROR, message, guild, channel, member)
 
     def exception(self, message: str, guild: typing.Optional[discord.Guild] = None, channel: typing.Optional[discord.ChannelType] = None, member: typing.Optional[discord.Member] = None):
-        return self.logger.exception(self.make_message_prefix(guild, channel, member) + str(message))
+        return self.log(logging.ERROR, message, guild, channel, member, exc_info=True)
 
 
 class LoggerConstant:
@@ -0,0 +1,162 @@
+import asyncio
+import collections
+import statistics
+import sys
+import threading
+import time
+import traceback
+import typing
+
+from utils import metrics
+
+
+class SlowCallback:
+    """
+    A moment where the event loop was blocked for longer than the threshold.
+    """
+    __slots__ = ("when", "duration", "task", "command", "stack")
+
+    def __init__(self, when: float, duration: float, task: str, command: typing.Optional[str], stack: typing.List[str]):
+        self.when = when
+        self.duration = duration
+        self.task = task
+        self.command = command
+        self.stack = stack
+
+
+def find_command(frame) -> typing.Optional[str]:
+    """
+    Name of the command being run by the given stack, if any, found through the ctx local of one of its frames.
+    """
+    while frame is not None:
+        ctx = frame.f_locals.get("ctx")
+        command = getattr(ctx, "command", None)
+        if command is not None:
+            return getattr(command, "qualified_name", str(command))
+        frame = frame.f_back
+    return None
+
+
+def describe_task(task) -> str:
+    if task is None:
+        return "(no task: plain callback)"
+    coro = getattr(task, "_coro", None)
+    return getattr(coro, "__qualname__", repr(task))
+
+
+class LoopMonitor:
+    """
+    Cheap replacement for the asyncio debug mode, that can be turned on and off while the bot runs.
+
+    A callback scheduled every few milliseconds on the loop acts as a heartbeat, and gives the lag samples.
+    A watchdog thread checks it: when the loop stops beating for longer than the threshold, the watchdog captures the
+    stack of the loop thread, which is the code blocking it, along with the task and command it belongs to.
+    """
+    def __init__(self, loop: asyncio.AbstractEventLoop, threshold: float, lag_interval: float, history: int):
+        self.loop = loop
+        self.threshold = threshold
+        self.lag_interval = lag_interval
+        self.slow_callbacks: typing.Deque[SlowCallback] = collections.deque(maxlen=history)
+        self.lag_samples: typing.Deque[float] = collections.deque(maxlen=600)
+
+        self.running = False
+        self._beat_interval = min(threshold / 4, lag_interval)
+        self._last_beat = 0.0
+        self._last_sample = 0.0
+        self._handle: typing.Optional[asyncio.Handle] = None
+        self._current_stall: typing.Optional[SlowCallback] = None
+        self._loop_thread_id: typing.Optional[int] = None
+        self._watchdog: typing.Optional[threading.Thread] = None
+        self._stop = threading.Event()
+
+    def start(self):
+        """
+        Must be called from the event loop thread.
+        """
+        if self.running:
+            return
+
+        self.running = True
+        self._loop_thread_id = threading.get_ident()
+        self._last_beat = self._last_sample = time.perf_counter()
+        self._handle = self.loop.call_later(self._beat_interval, self._beat)
+
+        if self._watchdog is not None:
+            # Quickly stopped and started again: the previous watchdog must be gone, or both would record the same stalls.
+            # It wakes up as soon as its event is set, so this doesn't block for long.
+            self._watchdog.join(timeout=1)
+
+        # An event per watchdog, so that starting again can't clear the one an old watchdog hasn't seen yet
+        self._stop = threading.Event()
+        self._watchdog = threading.Thread(target=self._watch, args=(self._stop,), name="loop-monitor", daemon=True)
+        self._watchdog.start()
+
+    def stop(self):
+        if not self.running:
+            return
+
+        self.running = False
+        self._stop.set()
+        if self._handle is not None:
+            self._handle.cancel()
+
+    def _beat(self):
+        now = time.perf_counter()
+        lag = max(0.0, now - self._last_beat - self._beat_interval)
+        self._last_beat = now
+
+        stall = self._current_stall
+        if stall is not None:
+            stall.duration = lag
+            self._current_stall = None
+
+        if now - self._last_sample >= self.lag_interval:
+            self._last_sample = now
+            self.lag_samples.append(lag)
+            metrics.LOOP_LAG.set(lag)
+            metrics.LOOP_LAG_HISTOGRAM.observe(lag)
+
+        self._handle = self.loop.call_later(self._beat_interval, self._beat)
+
+    def _watch(self, stop: threading.Event):
+        while not stop.wait(self._beat_interval):
+            blocked_for = time.perf_counter() - self._last_beat - self._beat_interval
+            if blocked_for < self.threshold or self._current_stall is not None:
+                continue
+
+            frame = sys._current_frames().get(self._loop_thread_id)
+            if frame is None:
+                continue
+
+            current_task = getattr(asyncio, "current_task", None) or asyncio.Task.current_task
+            try:
+                task = current_task(loop=self.loop)
+            except RuntimeError:
+                task = None
+
+            stall = SlowCallback(when=time.time(), duration=blocked_for, task=describe_task(task), command=find_command(frame),
+                                 stack=traceback.format_stack(frame))
+            del frame
+            self._current_stall = stall
+            self.slow_callbacks.append(stall)
+
+    def lag_summary(self) -> dict:
+        samples = sorted(self.lag_samples)
+        if not samples:
+            return {"samples": 0, "mean": 0.0, "p50": 0.0, "p99": 0.0, "max": 0.0}
+        return {"samples": len(samples), "mean": statistics.mean(samples), "p50": samples[int(0.5 * (len(samples) - 1))],
+                "p99": samples[int(0.99 * (len(samples) - 1))], "max": samples[-1]}
+
+    def report(self, count: int = 5, stack_lines: int = 6) -> str:
+        lag = self.lag_summary()
+        lines = [f"Loop monitor {'running' if self.running else 'stopped'} (threshold {self.threshold * 1000:.0f}ms)",
+                 f"Lag over {lag['samples']} samples: mean {lag['mean'] * 1000:.1f}ms, p50 {lag['p50'] * 1000:.1f}ms, "
+                 f"p99 {lag['p99'] * 1000:.1f}ms, max {lag['max'] * 1000:.1f}ms",
+                 f"{len(self.slow_callbacks)} slow callbacks recorded"]
+
+        for stall in list(self.slow_callbacks)[-count:]:
+            when = time.strftime("%H:%M:%S", time.localtime(stall.when))
+            lines.append(f"\n[{when}] {stall.duration * 1000:.0f}ms in {stall.task}" + (f" (command {stall.command})" if stall.command else ""))
+            lines.extend("  " + line.rstrip().replace("\n", "\n  ") for line in stall.stack[-stack_lines:])
+
+        return "\n".join(lines)
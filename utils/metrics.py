@@ -0,0 +1,166 @@
+import contextlib
+import time
+import typing
+
+from aiohttp import web
+
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60)
+
+
+def format_labels(labelnames: typing.Sequence[str], labelvalues: typing.Sequence[str], extra: str = "") -> str:
+    pairs = []
+    for name, value in zip(labelnames, labelvalues):
+        value = str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+        pairs.append(f'{name}="{value}"')
+    if extra:
+        pairs.append(extra)
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+
+def format_value(value: float) -> str:
+    if value == float("inf"):
+        return "+Inf"
+    return repr(float(value)) if not float(value).is_integer() else str(int(value))
+
+
+class Metric:
+    type_name = ""
+
+    def __init__(self, name: str, documentation: str, labelnames: typing.Sequence[str] = ()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+
+    def _key(self, labels: dict) -> typing.Tuple[str, ...]:
+        return tuple(str(labels[name]) for name in self.labelnames)
+
+    def samples(self) -> typing.Iterable[str]:
+        raise NotImplementedError
+
+    def render(self) -> str:
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} {self.type_name}"]
+        lines.extend(self.samples())
+        return "\n".join(lines)
+
+
+class Counter(Metric):
+    type_name = "counter"
+
+    def __init__(self, name: str, documentation: str, labelnames: typing.Sequence[str] = ()):
+        super().__init__(name, documentation, labelnames)
+        self._values: typing.Dict[typing.Tuple[str, ...], float] = {}
+
+    def inc(self, amount: float = 1, **labels):
+        key = self._key(labels)
+        self._values[key] = self._values.get(key, 0) + amount
+
+    def samples(self):
+        for key, value in self._values.items():
+            yield f"{self.name}{format_labels(self.labelnames, key)} {format_value(value)}"
+
+
+class Gauge(Metric):
+    type_name = "gauge"
+
+    def __init__(self, name: str, documentation: str, labelnames: typing.Sequence[str] = ()):
+        super().__init__(name, documentation, labelnames)
+        self._values: typing.Dict[typing.Tuple[str, ...], float] = {}
+
+    def set(self, value: float, **labels):
+        self._values[self._key(labels)] = value
+
+    def samples(self):
+        for key, value in self._values.items():
+            yield f"{self.name}{format_labels(self.labelnames, key)} {format_value(value)}"
+
+
+class Histogram(Metric):
+    type_name = "histogram"
+
+    def __init__(self, name: str, documentation: str, labelnames: typing.Sequence[str] = (), buckets: typing.Sequence[float] = DEFAULT_BUCKETS):
+        super().__init__(name, documentation, labelnames)
+        self.buckets = tuple(sorted(buckets)) + (float("inf"),)
+        # labels -> [count per bucket (not cumulative)..., sum]
+        self._values: typing.Dict[typing.Tuple[str, ...], typing.List[float]] = {}
+
+    def observe(self, value: float, **labels):
+        key = self._key(labels)
+        counts = self._values.get(key)
+        if counts is None:
+            counts = self._values[key] = [0] * len(self.buckets) + [0.0]
+
+        for i, bound in enumerate(self.buckets):
+            if value <= bound:
+                counts[i] += 1
+                break
+        counts[-1] += value
+
+    @contextlib.contextmanager
+    def time(self, **labels):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - start, **labels)
+
+    def samples(self):
+        for key, counts in self._values.items():
+            cumulative = 0
+            for bound, count in zip(self.buckets, counts):
+                cumulative += count
+                le = 'le="' + format_value(bound) + '"'
+                yield f"{self.name}_bucket{format_labels(self.labelnames, key, extra=le)} {cumulative}"
+            yield f"{self.name}_sum{format_labels(self.labelnames, key)} {format_value(counts[-1])}"
+            yield f"{self.name}_count{format_labels(self.labelnames, key)} {cumulative}"
+
+
+class Registry:
+    def __init__(self):
+        self.metrics: typing.List[Metric] = []
+
+    def register(self, metric: Metric) -> Metric:
+        self.metrics.append(metric)
+        return metric
+
+    def render(self) -> str:
+        return "\n".join(metric.render() for metric in self.metrics) + "\n"
+
+
+REGISTRY = Registry()
+
+COMMANDS_LATENCY: Histogram = REGISTRY.register(Histogram("tspbot_command_duration_seconds", "Time spent running a command, from invoke to the end.", ["command", "status"]))
+UPSTREAM_LATENCY: Histogram = REGISTRY.register(Histogram("tspbot_upstream_request_duration_seconds", "Latency of the requests made to external services.", ["service"]))
+UPSTREAM_ERRORS: Counter = REGISTRY.register(Counter("tspbot_upstream_errors_total", "Failed requests to external services.", ["service"]))
+BULLETIN_CACHE: Counter = REGISTRY.register(Counter("tspbot_bulletin_cache_total", "Bulletin lookups, by cache result (fresh, stale or miss).", ["result"]))
+TROMBI_CACHE: Counter = REGISTRY.register(Counter("tspbot_trombi_cache_total", "Trombi search pages requested, by source (index, hit, coalesced or miss).", ["result"]))
+QUEUE_WAIT: Histogram = REGISTRY.register(Histogram("tspbot_queue_wait_seconds", "Time spent waiting for a slot before running.", ["queue"]))
+LOOP_LAG: Gauge = REGISTRY.register(Gauge("tspbot_event_loop_lag_seconds", "Last measured delay of the event loop in running a scheduled callback."))
+LOOP_LAG_HISTOGRAM: Histogram = REGISTRY.register(Histogram("tspbot_event_loop_lag_distribution_seconds", "Distribution of the event loop lag samples.",
+                                                            buckets=(0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 5)))
+
+
+class MetricsServer:
+    """
+    Serves the registry in the Prometheus text format, on a local address only.
+    """
+    def __init__(self, host: str, port: int, registry: Registry = REGISTRY):
+        self.host = host
+        self.port = port
+        self.registry = registry
+        self._runner: typing.Optional[web.AppRunner] = None
+
+    async def handle_metrics(self, request: web.Request) -> web.Response:
+        return web.Response(text=self.registry.render(), content_type="text/plain", charset="utf-8",
+                            headers={"X-Content-Type-Options": "nosniff"})
+
+    async def start(self):
+        app = web.Application()
+        app.router.add_get("/metrics", self.handle_metrics)
+        self._runner = web.AppRunner(app)
+        await self._runner.setup()
+        await web.TCPSite(self._runner, self.host, self.port).start()
+
+    async def stop(self):
+        if self._runner is not None:
+            await self._runner.cleanup()
+            self._runner = None
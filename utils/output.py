@@ -0,0 +1,154 @@
+import asyncio
+import collections
+import time
+import typing
+
+MESSAGE_LIMIT = 2000
+FENCE = "```"
+
+
+def is_fence(line: str) -> bool:
+    # A line like ```code``` opens and closes its block by itself
+    return line.startswith(FENCE) and line.count(FENCE) == 1
+
+
+def split_blocks(content: str) -> typing.List[typing.List[str]]:
+    """
+    The lines of content, grouped so that a code block, from its opening to its closing fence, stays together.
+    """
+    blocks = []
+    block = None
+    for line in content.split("\n"):
+        if block is not None:
+            block.append(line)
+            if is_fence(line):
+                blocks.append(block)
+                block = None
+        elif is_fence(line):
+            block = [line]
+        else:
+            blocks.append([line])
+
+    if block is not None:
+        blocks.append(block)
+
+    return blocks
+
+
+def joined_size(lines: typing.List[str]) -> int:
+    return sum(len(line) for line in lines) + max(len(lines) - 1, 0)
+
+
+def paginate(content: str, limit: int = MESSAGE_LIMIT) -> typing.List[str]:
+    """
+    Split content in as few messages of at most limit characters as possible.
+
+    Messages end at line breaks, and a code block is kept in a single message when it fits in one. Otherwise, it's
+    closed at the end of a message and opened again, with the same language, at the start of the next one.
+    """
+    pages = []
+    page: typing.List[str] = []
+    open_fence: typing.Optional[str] = None
+
+    for block in split_blocks(content):
+        # Better start a new message than cut a block that would fit in it
+        if page and joined_size(page + block) > limit and joined_size(block) <= limit:
+            pages.append(page)
+            page = []
+
+        if joined_size(page + block) <= limit:
+            page.extend(block)
+            continue
+
+        opener = block[0] if is_fence(block[0]) else None
+        # Room for the fences added around the pieces of a code block
+        width = limit - (len(opener) + len(FENCE) + 2 if opener else 0)
+
+        for index, line in enumerate(block):
+            for piece in [line[start:start + width] for start in range(0, len(line), width)] or [""]:
+                closes = open_fence is not None and index == len(block) - 1 and is_fence(line)
+                opens = opener is not None and index == 0
+                tail = [FENCE] if (open_fence is not None or opens) and not closes else []
+
+                if page and joined_size(page + [piece] + tail) > limit:
+                    pages.append(page + ([FENCE] if open_fence is not None else []))
+                    page = [open_fence] if open_fence is not None else []
+
+                page.append(piece)
+                if opens:
+                    open_fence = opener
+                elif closes:
+                    open_fence = None
+
+    if page:
+        pages.append(page)
+
+    texts = ["\n".join(page) for page in pages]
+    return [text for text in texts if text.strip()]
+
+
+class ChannelQueue:
+    """
+    Replies of several messages waiting to be sent to one channel. Their messages are sent in order, at most rate of
+    them every per seconds, which is what Discord allows before answering 429, rather than as fast as discord.py can.
+    """
+    def __init__(self, rate: int, per: float):
+        self.rate = rate
+        self.per = per
+        self.users = 0
+        self._lock = asyncio.Lock()
+        self._sent: typing.Deque[float] = collections.deque(maxlen=rate)
+
+    async def _wait_turn(self):
+        if len(self._sent) == self.rate:
+            delay = self._sent[0] + self.per - time.monotonic()
+            if delay > 0:
+                await asyncio.sleep(delay)
+
+    async def send(self, send: typing.Callable[..., typing.Awaitable], pages: typing.List[str], **kwargs) -> list:
+        """
+        Send the pages one after the other, without other replies of several messages in between.
+        Files go with the last page, and the other arguments with every page.
+        """
+        if len(pages) <= 1:
+            # discord.py already waits out the rate limit of the channel for a single message
+            return [await send(pages[0] if pages else None, **kwargs)]
+
+        files = {key: kwargs.pop(key) for key in ("file", "files", "embed") if kwargs.get(key) is not None}
+
+        messages = []
+        async with self._lock:
+            for number, page in enumerate(pages, start=1):
+                await self._wait_turn()
+                if number == len(pages):
+                    kwargs.update(files)
+                messages.append(await send(page, **kwargs))
+                self._sent.append(time.monotonic())
+
+        return messages
+
+
+class Output:
+    """
+    The channel queues of the bot, created as needed.
+    """
+    def __init__(self, config):
+        self.config = config
+        self.queues: typing.Dict[int, ChannelQueue] = {}
+
+    def queue(self, channel_id: int) -> ChannelQueue:
+        queue = self.queues.get(channel_id)
+        if queue is None:
+            if len(self.queues) >= self.config.output_max_queues:
+                # Forget the channels nothing is being sent to
+                self.queues = {key: queue for key, queue in self.queues.items() if queue.users}
+            queue = self.queues[channel_id] = ChannelQueue(self.config.output_rate, self.config.output_per)
+        return queue
+
+    async def send(self, channel_id: int, send: typing.Callable[..., typing.Awaitable], pages: typing.List[str], **kwargs) -> list:
+        queue = self.queue(channel_id)
+        queue.users += 1
+        try:
+            return await queue.send(send, pages, **kwargs)
+        finally:
+            queue.users -= 1
@@ -0,0 +1,138 @@
+import asyncio
+import concurrent.futures
+import json
+import math
+import os
+import time
+import typing
+
+from utils import metrics
+from utils.people_index import PeopleIndex
+
+
+class PeopleDirectory:
+    """
+    Local copy of the trombi people directory, searched through a PeopleIndex.
+
+    It's downloaded in the background, and saved to disk so that a restart can search right away. Past the staleness
+    budget, only the people changed since the last sync are downloaded when the API allows it, and every so often the
+    whole directory, so that people who left are forgotten. Building a whole index runs on a worker thread.
+    """
+    def __init__(self, bot):
+        self.bot = bot
+        self.config = bot.config
+        self.index: typing.Optional[PeopleIndex] = None
+        self.synced_at: typing.Optional[float] = None
+        self.full_synced_at: typing.Optional[float] = None
+        self._executor = concurrent.futures.ThreadPoolExecutor(max_workers=1)
+        self._sync_lock = asyncio.Lock()
+
+    async def _run(self, func, *args):
+        return await self.bot.loop.run_in_executor(self._executor, func, *args)
+
+    def usable(self) -> bool:
+        return self.index is not None and self.synced_at + self.config.trombi_index_max_age > time.time()
+
+    def stale(self) -> bool:
+        return self.synced_at is None or self.synced_at + self.config.trombi_index_staleness <= time.time()
+
+    def search_page(self, query: str, page: int) -> dict:
+        """
+        A page of results, shaped like the replies of the search API.
+        """
+        results = self.index.search(query)
+        size = self.config.trombi_page_size
+        return {"people": results[(page - 1) * size:page * size], "page": page, "pages": max(1, math.ceil(len(results) / size)), "total": len(results)}
+
+    def _load_sync(self) -> typing.Tuple[float, float, PeopleIndex]:
+        with open(self.config.trombi_index_path, "r") as f:
+            saved = json.load(f)
+        return saved["synced_at"], saved["full_synced_at"], PeopleIndex(saved["people"])
+
+    def _save_sync(self, saved: dict):
+        path = self.config.trombi_index_path
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        with open(path + ".tmp", "w") as f:
+            json.dump(saved, f)
+        os.replace(path + ".tmp", path)
+
+    async def load(self):
+        try:
+            self.synced_at, self.full_synced_at, self.index = await self._run(self._load_sync)
+        except FileNotFoundError:
+            return
+        except (ValueError, KeyError):
+            self.bot.logger.exception(f"Unreadable trombi copy at {self.config.trombi_index_path}, it will be downloaded again.")
+            return
+
+        self.bot.logger.info(f"Loaded {len(self.index)} people from the trombi copy.")
+
+    async def fetch_page(self, page: int, since: typing.Optional[float]) -> dict:
+        params = {"page": page}
+        if since is not None:
+            params[self.config.trombi_people_since_param] = int(since)
+
+        try:
+            with metrics.UPSTREAM_LATENCY.time(service="trombi"):
+                async with self.bot.session.get(self.config.trombi_people_url, params=params) as resp:
+                    resp.raise_for_status()
+                    return await resp.json()
+        except Exception:
+            metrics.UPSTREAM_ERRORS.inc(service="trombi")
+            raise
+
+    async def download(self, since: typing.Optional[float] = None) -> typing.List[dict]:
+        first = await self.fetch_page(1, since)
+        people = list(first["people"])
+        pages = first.get("pages")
+
+        if pages is None:
+            # Without a number of pages, they have to be read one after the other until an empty one
+            page = 2
+            while True:
+                reply = await self.fetch_page(page, since)
+                if not reply["people"]:
+                    break
+                people.extend(reply["people"])
+                page += 1
+        else:
+            semaphore = asyncio.Semaphore(self.config.trombi_sync_concurrency)
+
+            async def fetch(page):
+                async with semaphore:
+                    return await self.fetch_page(page, since)
+
+            for reply in await asyncio.gather(*[fetch(page) for page in range(2, pages + 1)]):
+                people.extend(reply["people"])
+
+        return people
+
+    async def sync(self, full: bool = False):
+        # The background loop and the sync command could otherwise download everything twice
+        async with self._sync_lock:
+            await self._sync(full)
+
+    async def _sync(self, full: bool):
+        started = time.time()
+        incremental = not full and self.index is not None and self.config.trombi_people_since_param is not None \
+            and self.full_synced_at + self.config.trombi_index_full_sync_interval > started
+
+        people = await self.download(self.synced_at if incremental else None)
+
+        if incremental and len(people) <= 100:
+            self.index.update(people)
+        else:
+            # Searches keep using the current index until the new one is ready
+            base = list(self.index.people.values()) if incremental else []
+            self.index = await self._run(PeopleIndex, base + people)
+            if not incremental:
+                self.full_synced_at = started
+
+        self.synced_at = started
+        self.bot.logger.info(f"[trombi] {'Incremental' if incremental else 'Full'} sync done in {time.time() - started:.1f}s: "
+                             f"{len(people)} people downloaded, {len(self.index)} known.")
+
+        await self._run(self._save_sync, {"synced_at": self.synced_at, "full_synced_at": self.full_synced_at, "people": list(self.index.people.values())})
+
+    def close(self):
+        self._executor.shutdown(wait=False)
@@ -0,0 +1,196 @@
+import bisect
+import collections
+import re
+import typing
+import unicodedata
+
+TOKEN_REGEX = re.compile(r"[a-z0-9]+")
+
+# Scores of a query word matching a word of a person
+EXACT = 3
+PREFIX = 2
+FUZZY = 1
+
+# Query words this long may be two typos away from a word of a person, one typo for shorter ones
+LONG_WORD = 8
+
+
+def fold(text: str) -> str:
+    """
+    Lowercase, accents removed: "Léa Chloé" -> "lea chloe".
+    """
+    decomposed = unicodedata.normalize("NFKD", text.casefold())
+    return "".join(char for char in decomposed if not unicodedata.combining(char))
+
+
+def tokenize(text: str) -> typing.List[str]:
+    return TOKEN_REGEX.findall(fold(text))
+
+
+def within_distance(a: str, b: str, max_distance: int) -> bool:
+    """
+    Whether a and b are at most max_distance typos apart (inserted, missing, wrong or swapped letters).
+    """
+    if abs(len(a) - len(b)) > max_distance:
+        return False
+
+    before_previous = None
+    previous = list(range(len(b) + 1))
+    for i in range(1, len(a) + 1):
+        current = [i]
+        for j in range(1, len(b) + 1):
+            distance = min(previous[j] + 1, current[j - 1] + 1, previous[j - 1] + (a[i - 1] != b[j - 1]))
+            if i > 1 and j > 1 and a[i - 1] == b[j - 2] and a[i - 2] == b[j - 1]:
+                distance = min(distance, before_previous[j - 2] + 1)
+            current.append(distance)
+        if min(current) > max_distance:
+            return False
+        before_previous, previous = previous, current
+
+    return previous[-1] <= max_distance
+
+
+def deletions(word: str, distance: int) -> typing.Set[str]:
+    """
+    Every string obtained by removing up to distance letters from word, word included.
+    """
+    results = {word}
+    edges = {word}
+    for _ in range(distance):
+        edges = {edge[:i] + edge[i + 1:] for edge in edges for i in range(len(edge))}
+        results |= edges
+    return results
+
+
+def indexed_deletions(token: str) -> typing.Set[str]:
+    """
+    The deletion index entries of a word of a person. Words that long queries can reach two typos away need
+    their two-letter removals too.
+    """
+    return deletions(token, 2 if len(token) >= LONG_WORD - 2 else 1)
+
+
+class PeopleIndex:
+    """
+    In-memory inverted index of the trombi people, answering searches without asking MiNET.
+
+    Names and logins are split into accent-insensitive words. A query matches the people having, for each of its words,
+    a word equal to it, starting with it, or when there are none, a word one typo away from it (two for long words).
+
+    Words are kept sorted, so the ones starting with a query word are found by bisection. Typos are found with a
+    deletion index: two words n typos apart have in common a word made by removing up to n letters from each.
+    """
+    def __init__(self, people: typing.Iterable[dict] = ()):
+        self.people: typing.Dict[str, dict] = {}
+        self._postings: typing.Dict[str, typing.Set[str]] = {}
+        self._tokens: typing.List[str] = []
+        self._deletions: typing.Dict[str, typing.Set[str]] = collections.defaultdict(set)
+        self.update(people)
+
+    def __len__(self):
+        return len(self.people)
+
+    @staticmethod
+    def person_tokens(person: dict) -> typing.Set[str]:
+        # A login such as dupont_c gives "dupont" and "c", like a query for it would
+        return set(tokenize(f"{person['login']} {person['first_name']} {person['last_name']}"))
+
+    def update(self, people: typing.Iterable[dict]):
+        """
+        Add people, or replace them if their login is already known.
+        """
+        new_tokens = set()
+        for person in people:
+            login = person["login"]
+            if login in self.people:
+                self._remove_postings(login)
+            self.people[login] = person
+            for token in self.person_tokens(person):
+                postings = self._postings.get(token)
+                if postings is None:
+                    postings = self._postings[token] = set()
+                    new_tokens.add(token)
+                postings.add(login)
+
+        if len(new_tokens) > 100:
+            self._tokens = sorted(self._postings)
+        else:
+            # A resync usually brings a handful of new people
+            for token in new_tokens:
+                bisect.insort(self._tokens, token)
+
+        for token in new_tokens:
+            for deletion in indexed_deletions(token):
+                self._deletions[deletion].add(token)
+
+    def remove(self, logins: typing.Iterable[str]):
+        for login in logins:
+            if login in self.people:
+                self._remove_postings(login)
+                del self.people[login]
+
+    def _remove_postings(self, login: str):
+        for token in self.person_tokens(self.people[login]):
+            postings = self._postings.get(token)
+            if postings is None:
+                continue
+            postings.discard(login)
+            if postings:
+                continue
+
+            del self._postings[token]
+            del self._tokens[bisect.bisect_left(self._tokens, token)]
+            for deletion in indexed_deletions(token):
+                candidates = self._deletions[deletion]
+                candidates.discard(token)
+                if not candidates:
+                    del self._deletions[deletion]
+
+    def _match_word(self, word: str) -> typing.Dict[str, int]:
+        """
+        login -> best score of the words of that person against this query word.
+        """
+        scores = {}
+
+        # Every word starting with this one is a contiguous range of the sorted words
+        index = bisect.bisect_left(self._tokens, word)
+        while index < len(self._tokens) and self._tokens[index].startswith(word):
+            token = self._tokens[index]
+            index += 1
+            score = EXACT if token == word else PREFIX
+            for login in self._postings[token]:
+                if scores.get(login, 0) < score:
+                    scores[login] = score
+
+        if not scores and len(word) >= 4:
+            max_distance = 1 if len(word) < LONG_WORD else 2
+            candidates = set()
+            for deletion in deletions(word, max_distance):
+                candidates |= self._deletions.get(deletion, set())
+            for token in candidates:
+                if within_distance(word, token, max_distance):
+                    for login in self._postings[token]:
+                        scores.setdefault(login, FUZZY)
+
+        return scores
+
+    def search(self, query: str) -> typing.List[dict]:
+        """
+        Every person matching all the words of the query, best matches first.
+        """
+        words = tokenize(query)
+        if not words:
+            return []
+
+        total_scores = None
+        for word in words:
+            scores = self._match_word(word)
+            if total_scores is None:
+                total_scores = scores
+            else:
+                total_scores = {login: total_scores[login] + score for login, score in scores.items() if login in total_scores}
+            if not total_scores:
+                return []
+
+        ranked = sorted(total_scores.items(), key=lambda item: (-item[1], fold(self.people[item[0]]["last_name"]), fold(self.people[item[0]]["first_name"])))
+        return [self.people[login] for login, score in ranked]
@@ -0,0 +1,236 @@
+import asyncio
+import concurrent.futures
+import hashlib
+import json
+import os
+import time
+import typing
+
+from utils import metrics
+
+
+class PhotoCache:
+    """
+    Trombi photos kept on disk, so that the same face isn't downloaded again for every command.
+
+    Photos are stored once per content, under their SHA-256, and an index maps each (uid, size) to one of them, along with
+    the ETag and Last-Modified the server sent. Past photos_max_age, the server is asked whether the photo changed
+    (If-None-Match / If-Modified-Since) instead of downloading it again. The least recently used photos are evicted
+    when the files exceed photos_cache_max_bytes. File I/O runs on a single worker thread, off the event loop.
+    """
+    def __init__(self, bot):
+        self.bot = bot
+        self.config = bot.config
+        self.path = self.config.photos_cache_path
+        self.index_path = os.path.join(self.path, "index.json")
+
+        # "uid/WxH" -> {"sha256", "etag", "last_modified", "fetched_at", "last_used"}
+        self.entries: typing.Optional[typing.Dict[str, dict]] = None
+        # sha256 -> size in bytes
+        self.blobs: typing.Dict[str, int] = {}
+
+        self._executor = concurrent.futures.ThreadPoolExecutor(max_workers=1)
+        self._downloads: typing.Dict[str, asyncio.Task] = {}
+        self._dirty = False
+        self._save_task: typing.Optional[asyncio.Task] = None
+        self.closed = False
+
+    @property
+    def total_bytes(self) -> int:
+        return sum(self.blobs.values())
+
+    def _blob_path(self, sha256: str) -> str:
+        return os.path.join(self.path, "blobs", f"{sha256}.jpg")
+
+    async def _run(self, func, *args):
+        return await self.bot.loop.run_in_executor(self._executor, func, *args)
+
+    def _load_sync(self) -> typing.Tuple[typing.Dict[str, dict], typing.Dict[str, int]]:
+        os.makedirs(os.path.join(self.path, "blobs"), exist_ok=True)
+        try:
+            with open(self.index_path, "r") as f:
+                entries = json.load(f)
+        except FileNotFoundError:
+            entries = {}
+
+        blobs = {}
+        for name in os.listdir(os.path.join(self.path, "blobs")):
+            if name.endswith(".jpg"):
+                blobs[name[:-4]] = os.path.getsize(os.path.join(self.path, "blobs", name))
+
+        # Entries pointing to a missing file are useless, and files nobody points to are garbage
+        entries = {key: entry for key, entry in entries.items() if entry["sha256"] in blobs}
+        for sha256 in set(blobs) - {entry["sha256"] for entry in entries.values()}:
+            os.remove(self._blob_path(sha256))
+            del blobs[sha256]
+
+        return entries, blobs
+
+    def _save_sync(self, entries: typing.Dict[str, dict]):
+        with open(self.index_path + ".tmp", "w") as f:
+            json.dump(entries, f)
+        os.replace(self.index_path + ".tmp", self.index_path)
+
+    def _read_sync(self, sha256: str) -> bytes:
+        with open(self._blob_path(sha256), "rb") as f:
+            return f.read()
+
+    def _write_sync(self, sha256: str, data: bytes):
+        blob_path = self._blob_path(sha256)
+        if os.path.exists(blob_path):
+            return  # Same content, already stored for another uid or size
+        with open(blob_path + ".tmp", "wb") as f:
+            f.write(data)
+        os.replace(blob_path + ".tmp", blob_path)
+
+    def _remove_sync(self, sha256: str):
+        try:
+            os.remove(self._blob_path(sha256))
+        except FileNotFoundError:
+            pass
+
+    async def _ensure_loaded(self):
+        if self.entries is None:
+            try:
+                entries, blobs = await self._run(self._load_sync)
+            except (OSError, ValueError, KeyError):
+                self.bot.logger.exception(f"[photo_cache] Unreadable index at {self.index_path}, starting from scratch.")
+                entries, blobs = {}, {}
+            # Another coroutine may have loaded it while we were waiting
+            if self.entries is None:
+                self.entries, self.blobs = entries, blobs
+                self.bot.logger.debug(f"[photo_cache] {len(self.entries)} photos available on disk ({self.total_bytes} bytes).")
+
+    def _mark_dirty(self):
+        self._dirty = True
+        if self._save_task is None:
+            self._save_task = self.bot.loop.create_task(self._save_later())
+
+    async def _save_later(self):
+        try:
+            while self._dirty:
+                await asyncio.sleep(self.config.photos_cache_save_delay)
+                await self.save()
+        finally:
+            self._save_task = None
+
+    async def save(self):
+        if self.entries is None:
+            return
+        self._dirty = False
+        await self._run(self._save_sync, dict(self.entries))
+
+    async def _evict(self, keep: str):
+        """
+        Forget the least recently used photos until the files fit in the budget, except keep, the one just downloaded.
+        """
+        total_bytes = self.total_bytes
+        if total_bytes <= self.config.photos_cache_max_bytes:
+            return
+
+        references = {}
+        for entry in self.entries.values():
+            references[entry["sha256"]] = references.get(entry["sha256"], 0) + 1
+
+        for key, entry in sorted(self.entries.items(), key=lambda item: item[1]["last_used"]):
+            if total_bytes <= self.config.photos_cache_max_bytes:
+                break
+            if key == keep:
+                # Even alone over the budget, it's the photo being asked for
+                continue
+            del self.entries[key]
+            sha256 = entry["sha256"]
+            references[sha256] -= 1
+            if not references[sha256]:
+                total_bytes -= self.blobs.pop(sha256)
+                await self._run(self._remove_sync, sha256)
+
+        self._mark_dirty()
+
+    async def _forget_blob_if_unused(self, sha256: str):
+        if sha256 in self.blobs and not any(entry["sha256"] == sha256 for entry in self.entries.values()):
+            del self.blobs[sha256]
+            await self._run(self._remove_sync, sha256)
+
+    async def _download(self, key: str, uid: str, width: int, height: int) -> typing.Optional[bytes]:
+        entry = self.entries.get(key)
+        headers = {}
+        if entry is not None:
+            if entry.get("etag"):
+                headers["If-None-Match"] = entry["etag"]
+            if entry.get("last_modified"):
+                headers["If-Modified-Since"] = entry["last_modified"]
+
+        try:
+            with metrics.UPSTREAM_LATENCY.time(service="trombi_photo"):
+                async with self.bot.session.get(self.config.trombi_photo_url, params={"uid": uid, "w": width, "h": height}, headers=headers) as resp:
+                    if resp.status == 304 and entry is not None:
+                        entry["fetched_at"] = time.time()
+                        self._mark_dirty()
+                        return await self._run(self._read_sync, entry["sha256"])
+
+                    if resp.status == 404:
+                        return None
+
+                    resp.raise_for_status()
+                    if not resp.content_type.startswith("image/"):
+                        # Most likely the CAS login page
+                        raise ValueError(f"Expected an image, got {resp.content_type}")
+
+                    data = await resp.read()
+                    etag = resp.headers.get("ETag")
+                    last_modified = resp.headers.get("Last-Modified")
+        except Exception:
+            metrics.UPSTREAM_ERRORS.inc(service="trombi_photo")
+            raise
+
+        sha256 = hashlib.sha256(data).hexdigest()
+        if sha256 not in self.blobs:
+            await self._run(self._write_sync, sha256, data)
+            self.blobs[sha256] = len(data)
+
+        self.entries[key] = {"sha256": sha256, "etag": etag, "last_modified": last_modified, "fetched_at": time.time(), "last_used": time.time()}
+        self._mark_dirty()
+
+        if entry is not None and entry["sha256"] != sha256:
+            await self._forget_blob_if_unused(entry["sha256"])
+
+        await self._evict(keep=key)
+        return data
+
+    async def get(self, uid: str, width: int, height: int) -> typing.Optional[bytes]:
+        """
+        The photo of uid at this size, or None if there's none. Raises if it couldn't be downloaded and isn't cached.
+        """
+        await self._ensure_loaded()
+        key = f"{uid}/{width}x{height}"
+
+        entry = self.entries.get(key)
+        if entry is not None:
+            entry["last_used"] = time.time()
+            self._mark_dirty()
+            if entry["fetched_at"] + self.config.photos_max_age > time.time():
+                return await self._run(self._read_sync, entry["sha256"])
+
+        # A single download per photo, however many people ask for it at once
+        download = self._downloads.get(key)
+        if download is None:
+            download = self.bot.loop.create_task(self._download(key, uid, width, height))
+            self._downloads[key] = download
+            download.add_done_callback(lambda task: self._downloads.pop(key, None))
+
+        try:
+            return await asyncio.shield(download)
+        except Exception:
+            if entry is None or key not in self.entries:
+                raise
+            # An old photo beats no photo
+            self.bot.logger.debug(f"[photo_cache] Couldn't revalidate the photo of {uid}, using the cached one.")
+            return await self._run(self._read_sync, entry["sha256"])
+
+    async def close(self):
+        self.closed = True
+        if self._save_task is not None:
+            self._save_task.cancel()
+        await self.save()
+        self._executor.shutdown(wait=True)
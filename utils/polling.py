@@ -0,0 +1,114 @@
+import datetime
+import random
+import time
+import typing
+
+
+def parse_date(date: str) -> datetime.date:
+    return datetime.datetime.strptime(date, "%Y-%m-%d").date()
+
+
+class PollState:
+    __slots__ = ("next_poll", "interval", "failures", "last_poll", "last_change", "running")
+
+    def __init__(self, next_poll: float):
+        self.next_poll = next_poll
+        self.interval: float = 0
+        self.failures = 0
+        self.last_poll: typing.Optional[float] = None
+        self.last_change: typing.Optional[float] = None
+        self.running = False
+
+
+class AdaptivePoller:
+    """
+    Decides when each watched account should be polled next.
+
+    Accounts are polled faster right after a change and during the configured exam windows, slower during the quiet hours,
+    and back off exponentially while polls fail or SIFI answers slowly. Every interval is jittered so polls don't all happen at once.
+    """
+    def __init__(self, config):
+        self.config = config
+        self.states: typing.Dict[typing.Hashable, PollState] = {}
+        self.exam_windows = [(parse_date(start), parse_date(end)) for start, end in config.notes_poll_exam_windows]
+
+    def add(self, key: typing.Hashable):
+        """
+        Start watching an account. Its first poll is spread over the next normal interval.
+        """
+        if key not in self.states:
+            self.states[key] = PollState(next_poll=time.time() + random.uniform(0, self.config.notes_poll_interval))
+
+    def remove(self, key: typing.Hashable):
+        self.states.pop(key, None)
+
+    def in_exam_window(self, now: float) -> bool:
+        today = datetime.date.fromtimestamp(now)
+        return any(start <= today <= end for start, end in self.exam_windows)
+
+    def in_quiet_hours(self, now: float) -> bool:
+        start, end = self.config.notes_poll_quiet_hours
+        hour = datetime.datetime.fromtimestamp(now).hour
+        if start <= end:
+            return start <= hour < end
+        else:
+            return hour >= start or hour < end
+
+    def base_interval(self, state: PollState, now: float) -> float:
+        config = self.config
+        if state.last_change is not None and now - state.last_change < config.notes_poll_recent_change:
+            return config.notes_poll_fast_interval
+        elif self.in_exam_window(now):
+            return config.notes_poll_fast_interval
+        elif self.in_quiet_hours(now):
+            return config.notes_poll_quiet_interval
+        else:
+            return config.notes_poll_interval
+
+    def _schedule(self, state: PollState, now: float, backoff: int = 0):
+        interval = min(self.base_interval(state, now) * (2 ** backoff), self.config.notes_poll_max_interval)
+        jitter = self.config.notes_poll_jitter
+        state.interval = interval * random.uniform(1 - jitter, 1 + jitter)
+        state.next_poll = now + state.interval
+        state.running = False
+
+    def due(self) -> typing.List[typing.Hashable]:
+        """
+        The accounts that should be polled now. They are marked as running until their result is recorded.
+        """
+        now = time.time()
+        keys = [key for key, state in self.states.items() if not state.running and state.next_poll <= now]
+        for key in keys:
+            self.states[key].running = True
+        return keys
+
+    def record_success(self, key: typing.Hashable, duration: float, changed: bool):
+        state = self.states.get(key)
+        if state is None:
+            return
+
+        now = time.time()
+        state.last_poll = now
+        if changed:
+            state.last_change = now
+
+        if duration > self.config.notes_poll_slow_response and not changed:
+            # SIFI is struggling, give it some air without counting it as a failure.
+            # (A poll that found changes also waited for the warm-up of the other bulletins, so its duration doesn't say much.)
+            self._schedule(state, now, backoff=1)
+        else:
+            state.failures = 0
+            self._schedule(state, now)
+
+    def record_failure(self, key: typing.Hashable):
+        state = self.states.get(key)
+        if state is None:
+            return
+
+        now = time.time()
+        state.last_poll = now
+        state.failures += 1
+        self._schedule(state, now, backoff=min(state.failures, 6))
+
+    def next_polls(self) -> typing.Dict[typing.Hashable, PollState]:
+        return dict(self.states)
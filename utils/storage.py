@@ -1,4 +1,9 @@
+import asyncio
+import concurrent.futures
 import json
+import os
+import sqlite3
+import typing
 
 import discord
 
@@ -13,14 +18,126 @@ class Profile:
         return {"tsp_user": self.tsp_user, "tsp_password": self.tsp_password, "show_rang": self.show_rang}
 
 
-class Storage:
+def read_json_profiles(snapshot_path: str, journal_path: str) -> typing.Tuple[dict, int, typing.List[int]]:
+    """
+    Load the JSON snapshot and replay the journal on top of it.
+
+    Returns the profiles, the number of journal records applied, and the line numbers of the records that couldn't be read.
+    """
+    with open(snapshot_path, "r") as f:
+        profiles = json.load(f)
+
+    applied = 0
+    corrupted = []
+
+    try:
+        with open(journal_path, "r") as f:
+            lines = f.readlines()
+    except FileNotFoundError:
+        return profiles, applied, corrupted
+
+    for line_number, line in enumerate(lines, start=1):
+        try:
+            record = json.loads(line)
+        except ValueError:
+            # A crash in the middle of an append leaves a torn last line behind. The change it held was never acknowledged.
+            corrupted.append(line_number)
+            continue
+        apply_record(profiles, record)
+        applied += 1
+
+    return profiles, applied, corrupted
+
+
+def apply_record(profiles: dict, record: dict):
+    if record["op"] == "set":
+        profiles[record["id"]] = record["profile"]
+    elif record["op"] == "del":
+        profiles.pop(record["id"], None)
+
+
+class JsonStorage:
+    """
+    Profiles store made of a JSON snapshot and an append-only journal.
+
+    Every change is appended to the journal as one JSON line, so saving a profile costs the same whatever the number of profiles.
+    The journal is periodically folded back into the snapshot in the background, and replayed on top of it at startup.
+    All the file I/O runs on a single worker thread, which keeps the writes ordered and off the event loop.
+    """
     def __init__(self, bot):
         self.bot = bot
+        self.snapshot_path = bot.config.profiles_path
+        self.journal_path = bot.config.profiles_journal_path
+
+        self._executor = concurrent.futures.ThreadPoolExecutor(max_workers=1)
+
+        self._profiles, self._journal_records, corrupted = read_json_profiles(self.snapshot_path, self.journal_path)
+
+        for line_number in corrupted:
+            self.bot.logger.warning(f"Ignoring corrupted record at {self.journal_path}:{line_number}")
+        self.bot.logger.info(f"Replayed {self._journal_records} journal records on top of {self.snapshot_path}.")
+
+        self._journal = open(self.journal_path, "a")
+        if corrupted:
+            # Appending after a torn line would glue the next record to it, and lose it at the next replay
+            self._compact_sync(self._profiles)
+            self._journal_records = 0
+        self._compaction_task = bot.loop.create_task(self._compaction_loop())
+
+    def _append_sync(self, line: str):
+        self._journal.write(line)
+        self._journal.flush()
+        os.fsync(self._journal.fileno())
 
-        with open("profiles.json", "r") as f:
-            self._profiles = json.load(f)
+    def _compact_sync(self, profiles: dict):
+        temp_path = self.snapshot_path + ".tmp"
+        with open(temp_path, "w") as f:
+            json.dump(profiles, f)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(temp_path, self.snapshot_path)
 
-    def get_all_profiles(self):
+        # Replaying the old journal on the new snapshot is harmless, so a crash right here doesn't lose anything.
+        self._journal.close()
+        self._journal = open(self.journal_path, "w")
+
+    async def _run_io(self, func, *args):
+        return await self.bot.loop.run_in_executor(self._executor, func, *args)
+
+    async def _append(self, record: dict):
+        apply_record(self._profiles, record)
+        self._journal_records += 1
+        await self._run_io(self._append_sync, json.dumps(record) + "\n")
+
+        if self._journal_records >= self.bot.config.profiles_compaction_records:
+            await self.compact()
+
+    async def compact(self):
+        if not self._journal_records:
+            return
+
+        # The copy is taken on the loop, and the worker thread runs jobs in order: every record appended before this point
+        # is in the snapshot, and every record appended after it lands in the fresh journal.
+        profiles = dict(self._profiles)
+        self._journal_records = 0
+        await self._run_io(self._compact_sync, profiles)
+        self.bot.logger.debug(f"Compacted profiles journal ({len(profiles)} profiles).")
+
+    async def _compaction_loop(self):
+        while True:
+            await asyncio.sleep(self.bot.config.profiles_compaction_interval)
+            try:
+                await self.compact()
+            except Exception:
+                self.bot.logger.exception("Error compacting the profiles journal. Will retry later.")
+
+    async def close(self):
+        self._compaction_task.cancel()
+        await self.compact()
+        self._journal.close()
+        self._executor.shutdown(wait=True)
+
+    async def get_all_profiles(self):
         profiles = {}
         for member_id, profile_dict in self._profiles.items():
             profiles[member_id] = Profile(profile_dict)
@@ -29,20 +146,137 @@ class Storage:
 
         return profiles
 
-    async def save_profiles(self):
-        with open("profiles.json", "w") as f:
-            json.dump(self._profiles, f)
+    async def save_profile(self, member: discord.Member, profile: Profile):
+        await self._append({"op": "set", "id": str(member.id), "profile": profile.to_dict()})
 
-    async def save_profile(self, member: discord.Member, profile:Profile):
-        self._profiles[str(member.id)] = profile.to_dict()
-        await self.save_profiles()
-
-    async def create_profile(self, member: discord.Member, tsp_user:str, tsp_password:str):
-        self._profiles[str(member.id)] = Profile({"tsp_user": tsp_user, "tsp_password": tsp_password}).to_dict()
-        await self.save_profiles()
+    async def create_profile(self, member: discord.Member, tsp_user: str, tsp_password: str):
+        profile = Profile({"tsp_user": tsp_user, "tsp_password": tsp_password})
+        await self._append({"op": "set", "id": str(member.id), "profile": profile.to_dict()})
 
     async def get_profile(self, member: discord.Member) -> Profile:
         return Profile(self._profiles[str(member.id)])
 
     async def has_profile(self, member: discord.Member):
         return str(member.id) in self._profiles.keys()
+
+
+class SQLiteStorage:
+    """
+    Profiles store backed by a SQLite database, with the same coroutine interface as JsonStorage.
+
+    The connection lives on a dedicated thread, where every query runs. Writes are grouped for a short while and committed
+    together in a single transaction. Profiles waiting for their batch are served from memory so reads always see them.
+    """
+    def __init__(self, bot):
+        self.bot = bot
+        self.path = bot.config.sqlite_path
+
+        self._executor = concurrent.futures.ThreadPoolExecutor(max_workers=1)
+        self._connection: typing.Optional[sqlite3.Connection] = None
+        self._pending: typing.Dict[int, dict] = {}
+        self._batch: typing.Optional[asyncio.Task] = None
+
+        new_database = not os.path.exists(self.path)
+        self._executor.submit(self._connect_sync).result()
+
+        if new_database and os.path.exists(bot.config.profiles_path):
+            count = self._executor.submit(self._migrate_sync, bot.config.profiles_path, bot.config.profiles_journal_path).result()
+            self.bot.logger.info(f"Migrated {count} profiles from {bot.config.profiles_path} to {self.path}.")
+
+    def _connect_sync(self):
+        self._connection = sqlite3.connect(self.path)
+        self._connection.execute("PRAGMA journal_mode=WAL")
+        self._connection.execute("CREATE TABLE IF NOT EXISTS profiles ("
+                                 "member_id INTEGER PRIMARY KEY, "
+                                 "tsp_user TEXT NOT NULL, "
+                                 "tsp_password TEXT NOT NULL, "
+                                 "show_rang INTEGER NOT NULL DEFAULT 1)")
+        self._connection.commit()
+
+    def _migrate_sync(self, snapshot_path: str, journal_path: str) -> int:
+        profiles, _, _ = read_json_profiles(snapshot_path, journal_path)
+        self._write_batch_sync([(int(member_id), profile_dict) for member_id, profile_dict in profiles.items()])
+        return len(profiles)
+
+    def _write_batch_sync(self, batch: typing.List[typing.Tuple[int, dict]]):
+        with self._connection:
+            self._connection.executemany("INSERT OR REPLACE INTO profiles (member_id, tsp_user, tsp_password, show_rang) VALUES (?, ?, ?, ?)",
+                                         [(member_id, p["tsp_user"], p["tsp_password"], int(p.get("show_rang", True))) for member_id, p in batch])
+
+    def _get_profile_sync(self, member_id: int) -> typing.Optional[dict]:
+        row = self._connection.execute("SELECT tsp_user, tsp_password, show_rang FROM profiles WHERE member_id = ?", (member_id,)).fetchone()
+        if row is None:
+            return None
+        return {"tsp_user": row[0], "tsp_password": row[1], "show_rang": bool(row[2])}
+
+    def _has_profile_sync(self, member_id: int) -> bool:
+        return self._connection.execute("SELECT 1 FROM profiles WHERE member_id = ?", (member_id,)).fetchone() is not None
+
+    def _get_all_profiles_sync(self) -> typing.Dict[str, dict]:
+        rows = self._connection.execute("SELECT member_id, tsp_user, tsp_password, show_rang FROM profiles").fetchall()
+        return {str(row[0]): {"tsp_user": row[1], "tsp_password": row[2], "show_rang": bool(row[3])} for row in rows}
+
+    def _close_sync(self):
+        self._connection.close()
+
+    async def _run(self, func, *args):
+        return await self.bot.loop.run_in_executor(self._executor, func, *args)
+
+    async def _flush_later(self):
+        await asyncio.sleep(self.bot.config.sqlite_batch_delay)
+        await self.flush()
+
+    async def flush(self):
+        batch, self._pending = self._pending, {}
+        self._batch = None
+        if batch:
+            await self._run(self._write_batch_sync, list(batch.items()))
+
+    async def _write(self, member: discord.Member, profile: Profile):
+        self._pending[member.id] = profile.to_dict()
+        if self._batch is None:
+            self._batch = self.bot.loop.create_task(self._flush_later())
+
+        # Shielded, so that a cancelled command doesn't cancel the batch of everyone else.
+        await asyncio.shield(self._batch)
+
+    async def close(self):
+        if self._batch is not None:
+            self._batch.cancel()
+        await self.flush()
+        await self._run(self._close_sync)
+        self._executor.shutdown(wait=True)
+
+    async def get_all_profiles(self):
+        profiles_dicts = await self._run(self._get_all_profiles_sync)
+        profiles_dicts.update({str(member_id): profile_dict for member_id, profile_dict in self._pending.items()})
+
+        profiles = {member_id: Profile(profile_dict) for member_id, profile_dict in profiles_dicts.items()}
+        self.bot.logger.info(f"Loaded {len(profiles)} profiles.")
+
+        return profiles
+
+    async def save_profile(self, member: discord.Member, profile: Profile):
+        await self._write(member, profile)
+
+    async def create_profile(self, member: discord.Member, tsp_user: str, tsp_password: str):
+        await self._write(member, Profile({"tsp_user": tsp_user, "tsp_password": tsp_password}))
+
+    async def get_profile(self, member: discord.Member) -> Profile:
+        profile_dict = self._pending.get(member.id)
+        if profile_dict is None:
+            profile_dict = await self._run(self._get_profile_sync, member.id)
+            if profile_dict is None:
+                raise KeyError(str(member.id))
+
+        return Profile(profile_dict)
+
+    async def has_profile(self, member: discord.Member):
+        if member.id in self._pending:
+            return True
+        return await self._run(self._has_profile_sync, member.id)
+
+
+def get_storage(bot) -> typing.Union[JsonStorage, SQLiteStorage]:
+    backends = {"json": JsonStorage, "sqlite": SQLiteStorage}
+    return backends[bot.config.storage_backend](bot)